@@ -0,0 +1,5 @@
+""" Benchmarks for the ltcstm pipeline. Run with
+
+        python -m benchmarks.run --output results.json
+
+    from the root of the repository. """
@@ -0,0 +1,76 @@
+""" Synthetic LaTeX document generator for the benchmarks. Paragraphs are taken from
+    the integration test document and shuffled into documents of any size, with the
+    requested number of lectures, sections, keypoints and pdfonly blocks. """
+
+
+import os
+import random
+
+import ltcstm.regex
+
+
+SEED_FILE = os.path.join(os.path.dirname(__file__), "..", "tests", "integration_test",
+                         "test.tex")
+
+
+def seed_paragraphs(filename=SEED_FILE):
+    """ Grabs the plain text paragraphs (no markers or pdfonly blocks) of the seed
+        document. """
+    with open(filename, "r") as file:
+        text = ltcstm.regex.remove_pdfonly(file.read())
+
+    paragraphs = []
+
+    for paragraph in text.split("\n\n"):
+        lines = [line for line in paragraph.splitlines() if not line.startswith("%%")]
+        paragraph = "\n".join(lines).strip()
+
+        if paragraph:
+            paragraphs.append(paragraph)
+
+    return paragraphs
+
+
+def spread(number, total):
+    """ Spreads number items evenly over total slots, returning the set of slots """
+    if number <= 0:
+        return set()
+
+    return {(i * total) // number for i in range(number)}
+
+
+def generate(size=1000, lectures=10, sections=20, keypoints=100, pdfonly=0.05,
+             seed=0):
+    """ Generates a synthetic document of size paragraphs. pdfonly is the fraction of
+        paragraphs that are wrapped in pdfonly blocks. """
+    rng = random.Random(seed)
+    paragraphs = seed_paragraphs()
+
+    lecture_slots = spread(lectures, size)
+    section_slots = spread(sections, size)
+    keypoint_slots = spread(keypoints, size)
+
+    output = []
+    lecture = section = keypoint = 0
+
+    for i in range(size):
+        if i in lecture_slots:
+            lecture += 1
+            output.append("%%\\lecture{{{}}}".format(lecture))
+
+        if i in section_slots:
+            section += 1
+            output.append("%%\\section{{Section {}}}".format(section))
+
+        paragraph = rng.choice(paragraphs)
+
+        if rng.random() < pdfonly:
+            paragraph = "%%@pdfonly\n{}\n%%@endpdfonly".format(paragraph)
+
+        output.append(paragraph)
+
+        if i in keypoint_slots:
+            keypoint += 1
+            output.append("%%\\keypoint{{Keypoint {} about $E = mc^2$}}".format(keypoint))
+
+    return "\n\n".join(output) + "\n"
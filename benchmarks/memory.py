@@ -0,0 +1,66 @@
+""" Measures the memory held by the Keypoint and Part objects built for a synthetic
+    document (with pandoc stubbed out), as reported by tracemalloc. """
+
+
+import argparse
+import contextlib
+import gc
+import json
+import sys
+import tracemalloc
+
+from ltcstm.storage import PostprocessedData, PreprocessedData
+
+from benchmarks.generate import generate
+
+
+def measure(text):
+    """ Returns the number of objects built for text and the bytes that they hold """
+    pre = PreprocessedData(text, remove_pdfonly=True)
+    post = PostprocessedData(pre, pre.output_text)
+
+    gc.collect()
+    tracemalloc.start()
+
+    lectures = post.categorise_part(pre.lectures, pre.lecture_uids, pre.lecture_payloads)
+    sections = post.categorise_part(pre.sections, pre.section_uids, pre.section_payloads)
+    keypoints = post.categorise_keypoints(pre.keypoints, pre.keypoint_uids,
+                                          pre.keypoint_payloads)
+
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "keypoints": len(keypoints),
+        "parts": len(lectures) + len(sections),
+        "bytes": current,
+        "bytes_per_keypoint": current / max(1, len(keypoints)),
+    }
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keypoints", type=int, nargs="+", default=[1000, 10000, 40000],
+                        help="number of keypoints (one per paragraph)")
+    parser.add_argument("--parts", type=float, default=0.02,
+                        help="lectures and sections, each, per keypoint")
+    args = parser.parse_args(argv)
+
+    results = []
+
+    for number in args.keypoints:
+        parts = max(1, int(number * args.parts))
+        text = generate(number, parts, parts, number, 0.0)
+
+        with contextlib.redirect_stdout(sys.stderr):
+            results.append(measure(text))
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+    return
+
+
+if __name__ == "__main__":
+    main()
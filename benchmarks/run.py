@@ -0,0 +1,151 @@
+""" Times each stage of the pipeline on synthetic documents, with pandoc stubbed out
+    so that only the pure-Python cost is measured. Results are written as JSON so they
+    can be compared between commits. """
+
+
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from ltcstm.convert import Converter
+from ltcstm.outline import get_outline
+from ltcstm.regex import remove_pdfonly
+from ltcstm.storage import MasterData, PostprocessedData, PreprocessedData, split_data
+
+from benchmarks.generate import generate
+
+
+class IdentityConverter(Converter):
+    """ Stands in for pandoc: returns the text unchanged """
+
+    def convert(self, text, to, format, extra_args=()):
+        return text
+
+
+def best_of(function, repeat):
+    """ Runs function repeat times, returning the shortest time and the last result """
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def time_stages(text, repeat=3):
+    """ Times each stage of the pipeline on text, returning a dictionary of seconds """
+    stages = {}
+
+    stages["outline"], _ = best_of(lambda: get_outline(text), repeat)
+    stages["remove_pdfonly"], stripped = best_of(lambda: remove_pdfonly(text), repeat)
+
+    stages["PreprocessedData"], pre = best_of(lambda: PreprocessedData(stripped), repeat)
+
+    markdown = IdentityConverter().convert(pre.output_text, "markdown", "latex")
+
+    stages["PostprocessedData"], post = best_of(lambda: PostprocessedData(pre, markdown),
+                                                repeat)
+
+    def find_locations():
+        post.line_index = None
+        return post.find_locations(markdown, pre.keypoint_uids)
+
+    stages["find_locations"], _ = best_of(find_locations, repeat)
+    stages["categorise_part"], _ = best_of(
+        lambda: post.categorise_part(pre.sections, pre.section_uids), repeat
+    )
+    stages["categorise_keypoints"], _ = best_of(
+        lambda: post.categorise_keypoints(pre.keypoints, pre.keypoint_uids), repeat
+    )
+    stages["replace_all"], _ = best_of(lambda: post.replace_all(markdown), repeat)
+
+    master = MasterData(text, cache=False, converter=IdentityConverter())
+
+    stages["split_data"], split = best_of(lambda: split_data(master), repeat)
+    stages["json"], _ = best_of(lambda: [json.dumps(x) for x in split], repeat)
+
+    stages["MasterData"], _ = best_of(
+        lambda: MasterData(text, cache=False, converter=IdentityConverter()), repeat
+    )
+
+    return stages
+
+
+def git_commit():
+    """ The current commit, if we are in a git repository """
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+    return output.decode("utf-8").strip()
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[250, 1000, 4000],
+                        help="document sizes, in paragraphs")
+    parser.add_argument("--lectures", type=float, default=0.01,
+                        help="lectures per paragraph")
+    parser.add_argument("--sections", type=float, default=0.02,
+                        help="sections per paragraph")
+    parser.add_argument("--keypoints", type=float, default=0.1,
+                        help="keypoints per paragraph")
+    parser.add_argument("--pdfonly", type=float, default=0.05,
+                        help="fraction of paragraphs in pdfonly blocks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="-", help="output JSON file, - for stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+
+    for size in args.sizes:
+        parameters = {
+            "size": size,
+            "lectures": max(1, int(size * args.lectures)),
+            "sections": max(1, int(size * args.sections)),
+            "keypoints": int(size * args.keypoints),
+            "pdfonly": args.pdfonly,
+        }
+
+        text = generate(**parameters)
+
+        print("Timing {} bytes: {}".format(len(text), parameters), file=sys.stderr)
+
+        # Keep the pipeline's progress messages out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            stages = time_stages(text, args.repeat)
+
+        results.append({
+            "parameters": parameters,
+            "bytes": len(text),
+            "stages": stages,
+        })
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
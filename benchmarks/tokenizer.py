@@ -0,0 +1,149 @@
+""" Compares ltcstm.tokenizer.parse with the PLY lexer and parser that compile.py used
+    to build for every chapter, on synthetic chapters of increasing size. The two
+    must give the same blocks; the times of each are written as JSON. Requires ply. """
+
+
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import ply.lex as lex
+import ply.yacc as yacc
+
+from ltcstm.tokenizer import parse
+
+from benchmarks.generate import generate
+
+
+class PLYRules(object):
+    """ The token rules and grammar of the PLY path, as they were in compile.py """
+
+    tokens = ("KEY", "TEXT", "PDFONLYBEGIN", "PDFONLYEND")
+
+    def __init__(self, get_uid, register):
+        self.get_uid = get_uid
+        self.register = register
+
+
+    def t_KEY(self, t):
+        r'%%\\(?P<key>\w+)\{(?P<value>.*)\}'
+        key = t.lexer.lexmatch.group('key')
+        value = t.lexer.lexmatch.group('value')
+        uid = self.get_uid()
+        self.register(key, value, uid)
+        t.value = (key, value, uid)
+        return t
+
+
+    def t_PDFONLYBEGIN(self, t):
+        r'%%@pdfonly(?P<txt>.*?)'
+        t.value = ('PDFONLYBEGIN', t.lexer.lexmatch.group('txt'))
+        return t
+
+
+    def t_PDFONLYEND(self, t):
+        r'%%@endpdfonly'
+        t.value = ('PDFONLYEND', t.lexer.lexmatch.group('txt'))
+        return t
+
+
+    def t_TEXT(self, t):
+        r'(?:(?:\\%)|(?:[^%\\]+)|(?:\\[^%])|(%[^%])|(?:%%[^\\@]))+'
+        t.value = ('TEXT', t.value)
+        return t
+
+
+    def t_error(self, t):
+        raise ValueError("Illegal character {!r} at index {}".format(t.value[0], t.lexpos))
+
+
+    def p_blocks(self, p):
+        'blocks : block blocks'
+        p[0] = [p[1]] + p[2]
+
+
+    def p_blocksnone(self, p):
+        'blocks : '
+        p[0] = []
+
+
+    def p_pdfonly(self, p):
+        'PDFONLY : PDFONLYBEGIN blocks PDFONLYEND'
+        p[0] = ('PDFONLY', p[2])
+
+
+    def p_block(self, p):
+        '''block : TEXT
+                 | KEY
+                 | PDFONLY
+        '''
+        p[0] = p[1]
+
+
+def ply_parse(text, get_uid, register):
+    """ Parses text as compile.py did: building the lexer, then the parser (without
+        writing its tables to disk), for every chapter """
+    rules = PLYRules(get_uid, register)
+    lexer = lex.lex(module=rules)
+    parser = yacc.yacc(module=rules, debug=False, write_tables=False)
+
+    return parser.parse(text, lexer=lexer)
+
+
+def run(function, text):
+    """ Times function(text, get_uid, register), returning the seconds taken, the
+        blocks and the registered keys """
+    counter = itertools.count()
+    registered = []
+
+    start = time.perf_counter()
+    blocks = function(text, lambda: str(next(counter)),
+                      lambda *key: registered.append(key))
+
+    return time.perf_counter() - start, blocks, registered
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="number of paragraphs per chapter")
+    parser.add_argument("--pdfonly", type=float, default=0.05,
+                        help="fraction of paragraphs in pdfonly blocks")
+    args = parser.parse_args(argv)
+
+    # PLY's parser recurses once per block
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10 * max(args.paragraphs)))
+
+    results = []
+
+    for size in args.paragraphs:
+        # A keypoint every paragraph, so that the chapter has plenty of tokens
+        text = generate(size, max(1, size // 50), max(1, size // 25), size, args.pdfonly)
+
+        time_ply, blocks_ply, registered_ply = run(ply_parse, text)
+        time_new, blocks_new, registered_new = run(parse, text)
+
+        assert blocks_ply == blocks_new, "Blocks differ for {} paragraphs".format(size)
+        assert registered_ply == registered_new, \
+            "Registered keys differ for {} paragraphs".format(size)
+
+        results.append({
+            "paragraphs": size,
+            "characters": len(text),
+            "blocks": len(blocks_new),
+            "ply": time_ply,
+            "tokenizer": time_new,
+            "speedup": time_ply / max(time_new, 1e-9),
+        })
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+    return
+
+
+if __name__ == "__main__":
+    main()
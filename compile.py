@@ -1,33 +1,100 @@
-import ply.lex as lex
-import ply.yacc as yacc
 import sys
 import os
+import ctypes
 import shutil
-import random
 import re
 import tempfile
 import subprocess
+import time
+import types
 import tidylib as tidy
 import ltmd
 import yaml
-import pypandoc
-
+from ltcstm.convert import convert, convert_batch, get_converter, set_converter, PandocServerPool
+from ltcstm.convert import init_servers, share_servers
+from ltcstm.manifest import BuildManifest, hash_bytes, hash_file, write_if_changed
+from ltcstm.cache import PandocCache, DEFAULT_CACHE_DIR
+from ltcstm.assets import Dispatcher, sync_files
+from ltcstm.watch import Watcher
+from ltcstm.regex import get_seed
+from ltcstm.bibliography import prepare_bibliography
+from ltcstm.html import CommentIndex
+from ltcstm.tokenizer import parse
+
+import argparse
 import configparser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+argParser=argparse.ArgumentParser(description='Compile the LaTeX notes to the middleman site')
+argParser.add_argument('config',nargs='?',default='litm.cfg',help='configuration file')
+argParser.add_argument('-j','--jobs',type=int,default=None,
+                      help='number of chapters to compile in parallel (default: [build] jobs, or 1)')
+argParser.add_argument('--pandoc-servers',type=int,default=None,
+                       help='run conversions on a pool of this many pandoc servers (or [build] pandoc_servers); '
+                            'with -j they are shared out between the jobs, at least one each')
+argParser.add_argument('-i','--incremental',action='store_true',
+                       help='only rebuild what changed since the last build (or [build] incremental = yes)')
+argParser.add_argument('--prune-bib',action='store_true',
+                       help='only give pandoc the references each chapter cites (or [build] prune_bibliography = yes)')
+argParser.add_argument('--no-tidy',action='store_true',
+                       help='do not run the HTML through tidy (or [build] tidy = no)')
+argParser.add_argument('-w','--watch',action='store_true',
+                       help='rebuild incrementally whenever the sources change (middleman is not run)')
+options=argParser.parse_args()
 
 config = configparser.ConfigParser()
-if len(sys.argv)<2:
-    config.read('litm.cfg')
-else:
-    config.read(sys.argv[1])
+config.read(options.config)
 compile_dir = config.get('path','compile_dir')
 tex_dir = config.get('path','tex_dir')
 image_dir = config.get('path','image_dir')
 web_dir = config.get('path','web_dir')
 args = sys.argv
 own_files = [ f.strip() for f in config.get('path','own_files').split(',')]
+if options.jobs is not None:
+    jobs=options.jobs
+else:
+    jobs=config.getint('build','jobs',fallback=1)
+incremental=options.incremental or options.watch or config.getboolean('build','incremental',fallback=False)
+if options.pandoc_servers is not None:
+    pandocServers=options.pandoc_servers
+else:
+    pandocServers=config.getint('build','pandoc_servers',fallback=0)
+pruneBib=options.prune_bib or config.getboolean('build','prune_bibliography',fallback=False)
+doTidy=not options.no_tidy and config.getboolean('build','tidy',fallback=True)
+tidyThreads=config.getint('build','tidy_threads',fallback=4)
+copyThreads=config.getint('build','copy_threads',fallback=8)
+linkAssets=config.getboolean('build','link_assets',fallback=True)
+
+TIDY_OPTIONS = {
+    "doctype" : "omit",
+    "show-body-only": "yes",
+}
+
+def tidyVersion():
+    # the version of libtidy (through pytidylib's ctypes handle), or '' if unknown
+    try:
+        lib=tidy.tidy.get_module_tidy()._tidy
+    except Exception:
+        return ''
+    for name in ['tidyLibraryVersion','tidyReleaseDate']:
+        try:
+            function=getattr(lib,name)
+        except AttributeError:
+            continue
+        function.restype=ctypes.c_char_p
+        return '{} {}'.format(name,function().decode('utf-8','replace'))
+    return ''
+
+# tidied html, by content hash. The options and libtidy version are part of
+# every key, so upgrading tidy invalidates the cache.
+tidyCache=PandocCache(os.path.join(DEFAULT_CACHE_DIR,'tidy')) if doTidy else None
+tidyKey=repr(sorted(TIDY_OPTIONS.items()))+'\0'+tidyVersion() if doTidy else ''
 
 def getUID():
-    return "{:0<10}".format(random.randint(0, 1e10))
+    # deterministic: seeded from the chapter contents (see lexFile), plus a counter
+    uid="{0}{1:04d}".format(lexer.uidSeed,lexer.uidCount)
+    lexer.uidCount+=1
+    return uid
 
 def register(key,value,uid):
     for k,dic in [('keypoint',lexer.keypoints),('image',lexer.images),('question',lexer.questions)]:        
@@ -48,64 +115,6 @@ def register(key,value,uid):
         lexer.lectures.append(value)
     lexer.uids[key][value]=uid
 
-tokens=(
-    'KEY',
-    'TEXT',
-    'PDFONLYBEGIN',
-    'PDFONLYEND',
-)
-
-
-def t_KEY(t):
-    r'%%\\(?P<key>\w+)\{(?P<value>.*)\}'
-    key=lexer.lexmatch.group('key')
-    value=lexer.lexmatch.group('value')
-    uid=getUID()
-    register(key,value,uid)
-    t.value=(key,value,uid)
-    return t
-
-def t_PDFONLYBEGIN(t):
-    r'%%@pdfonly(?P<txt>.*?)'
-    t.value=('PDFONLYBEGIN',lexer.lexmatch.group('txt'))
-    return t
-
-def t_PDFONLYEND(t):
-    r'%%@endpdfonly'
-    t.value=('PDFONLYEND',lexer.lexmatch.group('txt'))
-    return t
-
-def t_TEXT(t):
-    r'(?:(?:\\%)|(?:[^%\\]+)|(?:\\[^%])|(%[^%])|(?:%%[^\\@]))+'
-    t.value=('TEXT',t.value)
-
-    return t
-
-def p_blocks(p):
-    'blocks : block blocks'
-    #if the block is ignored the result is None
-    if p[1]:
-        p[0] = [p[1]]+p[2]
-    else:
-        p[0]=p[2]
-
-def p_blocksnone(p):
-    'blocks : '
-    p[0] = []
-
-def p_pdfonly(p):
-    'PDFONLY : PDFONLYBEGIN blocks PDFONLYEND'
-    p[0] = ('PDFONLY',p[2])    
-    
-def p_block(p):
-    '''block : TEXT
-             | KEY
-             | PDFONLY
-'''
-    p[0] = p[1]
-
-
-
 def getQuestionsHTML(key, extra_class=[]):
     classes = format_classes(extra_class + ['questions'])
     if key not in lexer.questions.keys():
@@ -114,13 +123,15 @@ def getQuestionsHTML(key, extra_class=[]):
         txt='<div class="{}">\n<h2>\nQuick Questions\n</h2>'.format(classes)
         for kp in lexer.questions[key]:
             div='''<div class="question">{kptxt}</div>'''.format(
-                kptxt=pypandoc.convert(kp,'html',format='tex'))
+                kptxt=lexer.questionsHTML[kp])
             txt+=div
         txt+='</div>'
         return txt
 
 def run_pandoc(content, bibliography=""):
     if bibliography:
+        # the bibliography is converted to CSL-JSON once, and cached
+        bibliography = prepare_bibliography(bibliography, content, "markdown", pruneBib)
         bib = ["--bibliography={}".format(bibliography)]
     else:
         bib = []
@@ -133,15 +144,15 @@ def run_pandoc(content, bibliography=""):
         "pandoc-citeproc"] + bib
 
     print("Running Pandoc (MD -> HTML)")
-    OutputData = pypandoc.convert_text(content, "html", format="md", extra_args=extra_args)
+    OutputData = convert(content, "html", "md", extra_args)
 
     return OutputData
 
-lexer=lex.lex()
-lastLecture=0
+# state of the chapter being compiled (kept under the name of the PLY lexer that
+# used to hold it)
+lexer=types.SimpleNamespace()
 
-def process(fileName):
-    global lastLecture
+def lexFile(fileName, lastLecture):
     # prepare lexer state
     if lastLecture==0:
         lexer.current={'section':'begining','lecture':'begining'}
@@ -160,11 +171,51 @@ def process(fileName):
         lexer.lectures=[]
     # parse the tex file
 
-    f=open(tex_dir + fileName,'r')
-    txt=f.read()
-    lexer.input(txt)
-    parser = yacc.yacc()
-    result = parser.parse(txt)
+    with open(tex_dir + fileName,'r') as f:
+        txt=f.read()
+    lexer.uidSeed=get_seed([txt],length=6,digits=True)
+    lexer.uidCount=0
+    return parse(txt, getUID, register)
+
+def sectionLectures(sec, lastLecture):
+    # find the lectures (and their keypoints) spanned by the section
+    lecs={}
+    if sec in lexer.keypoints.keys():
+        for kp in lexer.keypoints[sec]:
+            for lec in lexer.keypoints.keys():
+                if lec!=sec :
+                    if kp in lexer.keypoints[lec]:
+                        if not lec in lecs.keys():
+                            lecs[lec]=[]
+                        lecs[lec].append(kp)
+
+    lecnbrs=sorted([int(k) for k in lecs.keys() if not k=='begining' ])
+    if lecnbrs:
+        lastLecture=lecnbrs[-1]
+    leclist=[ {'number':str(i),'kps':lecs[str(i)]} for i in lecnbrs ]
+    # treat the case of split lecture
+    if 'begining' in lecs.keys():    
+        leclist.insert(0,{'number':str(lastLecture),'kps':lecs['begining']})
+    return leclist,lastLecture
+
+def carryLecture(fileName, lastLecture):
+    # cheap pre-pass (no pandoc): the lastLecture that fileName hands on to the next file
+    lexFile(fileName, lastLecture)
+    for sec in lexer.sections:
+        _,lastLecture=sectionLectures(sec, lastLecture)
+    return lastLecture
+
+def process(fileName, lastLecture=0):
+    # returns seclist, leclist, the (file, mode, text) outputs to be written in
+    # order, and the lastLecture to hand on to the next file
+    print("Compiling {}".format(fileName))
+    outputs=[]
+    result=lexFile(fileName, lastLecture)
+
+    # convert all of the questions in a single pandoc run
+
+    questions=sorted({q for qs in lexer.questions.values() for q in qs})
+    lexer.questionsHTML=dict(zip(questions,convert_batch(questions,'html','latex')))
 
     # prepare tex file for conversion to MD
     
@@ -205,49 +256,25 @@ def process(fileName):
     
     fullMDforHTML=re.sub(r"\[\\\\\] # (\d+)", r"<!-- \1 -->", fullMD)
     html=run_pandoc(fullMDforHTML, bibliography=tex_dir + 'bibliography.bib')
+    # find all of the <!-- uid --> markers in one pass
+    comments=CommentIndex(html)
 
     # separate the sections 
 
     db={'sections':{}}
     seclist=[]
     for sec in lexer.sections:
-        regex= r'<!-- {} -->'.format(lexer.begin['section'][sec])
-        regex+='(?P<txt>.*?)'
-        regex+=r'<!-- {} -->'.format(lexer.end['section'][sec])
-
-        match=re.search(regex ,html,re.MULTILINE+re.DOTALL)
-        txt=match.group('txt')
+        txt=comments.between(lexer.begin['section'][sec],lexer.end['section'][sec])
         txt=insertLectureDivs(txt)
         txt+=getKeyPointsHTML(sec)
         txt+=getQuestionsHTML(sec)
-        with open(compile_dir + '_'+sec.replace(' ','_')+'.html','w') as of:
-            tidy_options = {
-                "doctype" : "omit",
-                "show-body-only": "yes",           
-            }        
-            th,errs=tidy.tidy_document(txt, tidy_options)
-            of.write(th)
-        lecs={}
-        if sec in lexer.keypoints.keys():
-            for kp in lexer.keypoints[sec]:
-                for lec in lexer.keypoints.keys():
-                    if lec!=sec :
-                        if kp in lexer.keypoints[lec]:
-                            if not lec in lecs.keys():
-                                lecs[lec]=[]
-                            lecs[lec].append(kp)
+        outputs.append((compile_dir + '_'+sec.replace(' ','_')+'.html','w',txt))
         if sec in lexer.images.keys():
             images=lexer.images[sec]
         else:
             images=None
 
-        lecnbrs=sorted([int(k) for k in lecs.keys() if not k=='begining' ])
-        if lecnbrs:
-            lastLecture=lecnbrs[-1]
-        leclist=[ {'number':str(i),'kps':lecs[str(i)]} for i in lecnbrs ]
-        # treat the case of split lecture
-        if 'begining' in lecs.keys():    
-            leclist.insert(0,{'number':str(lastLecture),'kps':lecs['begining']})
+        leclist,lastLecture=sectionLectures(sec, lastLecture)
         if images:
             seclist.append({'lectures':leclist,'name':sec,'image':images[0]})
         else:
@@ -255,8 +282,8 @@ def process(fileName):
 
         if sec in lexer.keypoints.keys():
             items=['\\item {0}'.format(kp) for kp in lexer.keypoints[sec]]
-            with open(compile_dir+"/{0}_keypoints.tex".format(sec.replace(' ','-')),'w') as kptex:
-                kptex.write("\n".join(items))
+            outputs.append((compile_dir+"/{0}_keypoints.tex".format(sec.replace(' ','-')),'w',
+                            "\n".join(items)))
 
 
             
@@ -275,28 +302,19 @@ def process(fileName):
             labelEnd=lexer.end['section'][lexer.sections[-1]]
         else:
             labelEnd=lexer.end['lecture'][lec]
-        regex= r'<!-- {} -->'.format(labelBegin)
-        regex+='(?P<txt>.*?)'
-        regex+=r'<!-- {} -->'.format(labelEnd)
         # there is no match if this is the lastLecture of the last chapter and
         # there is no content before the first section o this chapter
-        match=re.search(regex ,html,re.MULTILINE+re.DOTALL)
-        if match:
+        match=comments.between(labelBegin,labelEnd)
+        if match is not None:
             txt=getKeyPointsHTML(lec, extra_class=['lecture-kps'])
-            txt+=match.group('txt')
+            txt+=match
             txt+=getQuestionsHTML(lec, extra_class=['lecture-qs'])
             if firstSplit:
                 rwaccess='a'
                 print ("adding to existing lecture...")
             else:
                 rwaccess='w'
-            with open(compile_dir + '_Lecture_'+lec+'.html',rwaccess) as of:
-                tidy_options = {
-                    "doctype" : "omit",
-                    "show-body-only": "yes",           
-                }        
-                th,errs=tidy.tidy_document(txt, tidy_options)
-                of.write(th)
+            outputs.append((compile_dir + '_Lecture_'+lec+'.html',rwaccess,txt))
 
             if lec in lexer.images.keys():
                 images=lexer.images[lec]
@@ -311,7 +329,54 @@ def process(fileName):
 
 
             
-    return seclist,leclist
+    return seclist,leclist,tidyOutputs(outputs),lastLecture
+
+def tidyHTML(txt):
+    # tidy a single html fragment, using the cache
+    key=hash_bytes((tidyKey+'\0'+txt).encode('utf-8'))
+    th=tidyCache.get(key)
+    if th is None:
+        th,errs=tidy.tidy_document(txt, TIDY_OPTIONS)
+        tidyCache.put(key,th)
+    return th
+
+def tidyOutputs(outputs):
+    # tidy all of the html outputs of a chapter at once, in a thread pool (tidy
+    # releases the GIL); does nothing if tidy is turned off
+    if not doTidy:
+        return outputs
+    html=[i for i,(f,mode,txt) in enumerate(outputs) if f.endswith('.html')]
+    with ThreadPoolExecutor(max(1,tidyThreads)) as executor:
+        tidied=list(executor.map(tidyHTML,[outputs[i][2] for i in html]))
+    outputs=list(outputs)
+    for i,th in zip(html,tidied):
+        outputs[i]=(outputs[i][0],outputs[i][1],th)
+    return outputs
+
+def writeOutputs(outputs):
+    # combine the writes to each file so that every file is written once, and
+    # not at all if its contents have not changed
+    contents={}
+    for fileName,mode,txt in outputs:
+        if mode=='w':
+            contents[fileName]=txt
+        else:
+            if fileName not in contents:
+                try:
+                    with open(fileName,'r') as f:
+                        contents[fileName]=f.read()
+                except OSError:
+                    contents[fileName]=''
+            contents[fileName]+=txt
+    for fileName,txt in contents.items():
+        write_if_changed(fileName,txt)
+
+def isClean(record, inputHash, lastLecture):
+    # can the previous build of a chapter be reused?
+    return (record is not None
+            and record['input']==inputHash
+            and record['lastLecture']==lastLecture
+            and all(os.path.exists(f) for f,_,_ in record['outputs']))
 
 
 def get_tex(directory):
@@ -328,79 +393,193 @@ def get_tex(directory):
     
     return own_files
 
-dbSections=[]
-dbLectures=[]
+def compileAll(files, jobs=1, manifest=None):
+    # compile every file, in parallel if jobs>1, and only those that changed since
+    # the last build if a manifest is given. The outputs are written in file order
+    # so the result is identical to a serial build.
+    if manifest is None and jobs<=1:
+        results={}
+        lastLecture=0
+        for f in files:
+            results[f]=process(f, lastLecture)
+            lastLecture=results[f][3]
+        dirty=set(files)
+    else:
+        records=manifest.chapters if manifest is not None else {}
+        hashes={f:hash_file(tex_dir + f) for f in files}
+        # the lecture carried over between files only needs the lexer
+        lastLectures=[]
+        dirty=set()
+        lastLecture=0
+        for f in files:
+            lastLectures.append(lastLecture)
+            if isClean(records.get(f), hashes[f], lastLecture):
+                lastLecture=records[f]['carry']
+            else:
+                dirty.add(f)
+                lastLecture=carryLecture(f, lastLecture)
+
+        todo=[(f,l) for f,l in zip(files,lastLectures) if f in dirty]
+        if jobs>1 and len(todo)>1:
+            # each job runs its own share of the pandoc servers; ours are stopped
+            # meanwhile, and restarted when they are next used
+            if pandocServers>0:
+                get_converter().close()
+                init=dict(initializer=init_servers,initargs=(share_servers(pandocServers,jobs),))
+            else:
+                init={}
+            with ProcessPoolExecutor(max_workers=jobs, **init) as pool:
+                compiled=list(pool.map(process, *zip(*todo)))
+        else:
+            compiled=[process(f,l) for f,l in todo]
+        results=dict(zip([f for f,_ in todo],compiled))
+
+        if manifest is not None:
+            # keep the outputs of every chapter: a lecture that is split over two
+            # chapters is rebuilt from both, even if only one of them changed
+            for (f,l),(seclist,leclist,outputs,carry) in zip(todo,compiled):
+                manifest.chapters[f]={
+                    'input':hashes[f],
+                    'lastLecture':l,
+                    'carry':carry,
+                    'outputs':outputs,
+                    'seclist':seclist,
+                    'leclist':leclist,
+                }
+            for f in list(manifest.chapters):
+                if f not in files:
+                    del manifest.chapters[f]
+
+    print("Compiled {} of {} files".format(len(dirty),len(files)))
+
+    # only the files that a compiled chapter writes to need to be written
+    touched={fileName for f in dirty for fileName,_,_ in results[f][2]}
+
+    dbSections=[]
+    dbLectures=[]
+    outputs=[]
+    for f in files:
+        if f in results:
+            seclist,leclist,fileOutputs,_=results[f]
+        else:
+            record=manifest.chapters[f]
+            seclist,leclist,fileOutputs=record['seclist'],record['leclist'],record['outputs']
+        outputs.extend(o for o in fileOutputs if o[0] in touched)
+        dbSections.append({'name':f.split('.')[0],'sections':seclist})
+        dbLectures.extend(leclist)
+    writeOutputs(outputs)
 
-try:
-    os.mkdir(compile_dir)
-except OSError:
-    pass
+    return dbSections,dbLectures
 
-files = get_tex('./tex')
+def build(manifest=None):
+    # compile the chapters and send everything to the website
+    files = get_tex('./tex')
 
-for f in files:
-    print("Compiling {}".format(f))
-    seclist,leclist=process(f)
-    dbSections.append({'name':f.split('.')[0],'sections':seclist})
-    dbLectures.extend(leclist)
+    if manifest is not None:
+        # turning tidy on or off changes every output
+        manifest.invalidate(hash_file(options.config)+('' if doTidy else '-notidy'),
+                            hash_file(tex_dir + 'bibliography.bib'))
 
-with open('./compiled/information.yaml', 'w') as f:
-    f.write(yaml.dump(dbSections))
-with open('./compiled/lectures.yaml', 'w') as f:
-    f.write(yaml.dump(dbLectures))
+    dbSections,dbLectures=compileAll(files, jobs, manifest)
 
-### Now we must deal with files, building middleman etc.
+    write_if_changed('./compiled/information.yaml', yaml.dump(dbSections))
+    write_if_changed('./compiled/lectures.yaml', yaml.dump(dbLectures))
 
-op_img_dir = web_dir + 'source/images/'
-op_data_dir = web_dir + 'data/'
-op_notes_dir = web_dir + 'source/notes/'
-op_lectures_dir = web_dir + 'source/lectures/'
+    ### Now we must deal with files, building middleman etc.
 
-for dir in [op_img_dir, op_data_dir, op_notes_dir, op_lectures_dir]:
-    try:
-        os.mkdir(dir)
-    except OSError:
-        pass
+    op_img_dir = web_dir + 'source/images/'
+    op_data_dir = web_dir + 'data/'
+    op_notes_dir = web_dir + 'source/notes/'
+    op_lectures_dir = web_dir + 'source/lectures/'
+
+    for dir in [op_img_dir, op_data_dir, op_notes_dir, op_lectures_dir]:
+        try:
+            os.mkdir(dir)
+        except OSError:
+            pass
 
-print("Copying Images...")
-for img in os.listdir(image_dir):
-    shutil.copyfile(image_dir + img, op_img_dir + img)
+    print("Copying Images...")
+    sync_files([(image_dir + img, op_img_dir + img) for img in os.listdir(image_dir)],
+               linkAssets, copyThreads)
 
-faq_dir = config.get('path','faq_dir')
-faq_dest = config.get('path', 'faq_dest')
-shutil.copyfile(faq_dir + '/faq.yaml', faq_dest +'/faq.yaml')
+    faq_dir = config.get('path','faq_dir')
+    faq_dest = config.get('path', 'faq_dest')
+    sync_files([(faq_dir + '/faq.yaml', faq_dest +'/faq.yaml')], False)
 
     
-print("Copying Compiled Files...")
-
-dispatch=[]
-for ftype in config.options('files'):
-    dispatch.append(
-        (re.compile(config.get('files',ftype)), config.get('destination',ftype) )
-    )
-
-
-for compiled in os.listdir(compile_dir):
-    found=False
-    for regex,dest in dispatch:
-        if regex.match(compiled):
-            found=True
-            print("sending {} to {}".format( compiled,dest ))
-            shutil.copyfile(compile_dir +'/'+  compiled, dest +'/' + compiled)
-            break
-    if not found:
-        print("Unable to classify file {}{}".format(compile_dir, compiled))
-        
-### Middleman stuff
-if config.has_option('middleman','run') and config.get('middleman','run')=='yes':
-    os.chdir(web_dir)
+    print("Copying Compiled Files...")
+
+    dispatch=Dispatcher([(config.get('files',ftype), config.get('destination',ftype))
+                         for ftype in config.options('files')])
+
+    toSend=[]
+    for compiled in os.listdir(compile_dir):
+        if compiled==BuildManifest.filename:
+            continue
+        dest=dispatch.destination(compiled)
+        if dest is None:
+            print("Unable to classify file {}{}".format(compile_dir, compiled))
+        else:
+            toSend.append((compile_dir +'/'+  compiled, dest +'/' + compiled))
+
+    for source,dest in sync_files(toSend, linkAssets, copyThreads):
+        print("sending {} to {}".format( os.path.basename(source),os.path.dirname(dest) ))
+
+    if manifest is not None:
+        manifest.save()
+
+def watch(manifest):
+    # rebuild after each burst of changes to the sources, until interrupted. Only
+    # the chapters whose input changed (and any lectures they carry into the next
+    # chapter) are recompiled, from the manifest kept in memory between builds.
+    # The bibliography lives in tex_dir. The configuration is only read on start
+    # up, so it is not watched.
+    paths=[tex_dir, image_dir]
+    watcher=Watcher(paths)
+    print("Watching {} for changes (Ctrl-C to stop)".format(', '.join(paths)))
+    print("Restart to pick up changes to {}".format(options.config))
+    try:
+        for changed in watcher:
+            print("Changed: {}".format(', '.join(sorted(changed))))
+            start=time.time()
+            try:
+                build(manifest)
+            except Exception as e:
+                # keep watching, so that the author can fix the error
+                print("Build failed: {!r}".format(e))
+            else:
+                print("Rebuilt in {:.2f}s".format(time.time()-start))
+    except KeyboardInterrupt:
+        pass
 
+if __name__ == '__main__':
     try:
-        print("Removing old build files")
-        shutil.rmtree("./build/")
-    except FileNotFoundError:
-        # no old build files
+        os.mkdir(compile_dir)
+    except OSError:
         pass
 
-    print("Building new middleman files")
-    os.system("bundle exec middleman build")
+    manifest=BuildManifest(compile_dir) if incremental else None
+
+    if pandocServers>0:
+        set_converter(PandocServerPool(pandocServers))
+    try:
+        build(manifest)
+        if options.watch:
+            watch(manifest)
+    finally:
+        set_converter(None).close()
+
+    ### Middleman stuff (a middleman server previews the watched build instead)
+    if (not options.watch and config.has_option('middleman','run')
+            and config.get('middleman','run')=='yes'):
+        os.chdir(web_dir)
+
+        try:
+            print("Removing old build files")
+            shutil.rmtree("./build/")
+        except FileNotFoundError:
+            # no old build files
+            pass
+
+        print("Building new middleman files")
+        os.system("bundle exec middleman build")
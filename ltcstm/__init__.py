@@ -1,6 +1,17 @@
 """ classic __init__.py """
 
+import ltcstm.assets as assets
+import ltcstm.bibliography as bibliography
+import ltcstm.blobs as blobs
+import ltcstm.cache as cache
 import ltcstm.config as config
+import ltcstm.convert as convert
+import ltcstm.html as html
 import ltcstm.io as io
+import ltcstm.manifest as manifest
+import ltcstm.outline as outline
 import ltcstm.regex as regex
 import ltcstm.storage as storage
+import ltcstm.timing as timing
+import ltcstm.tokenizer as tokenizer
+import ltcstm.watch as watch
@@ -0,0 +1,40 @@
+""" Command line entry point: processes many tex files in a single run, e.g.
+
+        python -m ltcstm notes/*.tex --bib bibliography.bib --output-dir json
+
+    See ltcstm.io.process_many. """
+
+
+import argparse
+
+from ltcstm.io import process_many, write_many
+
+
+def main(argv=None):
+    """ Command line entry point """
+    parser = argparse.ArgumentParser(prog="python -m ltcstm",
+                                     description="Splits LaTeX documents into lectures, "
+                                                 "sections and keypoints as JSON")
+    parser.add_argument("files", nargs="+", help="tex files, or glob patterns")
+    parser.add_argument("--bib", default="", help="bibliography shared by every file")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="directory to write the JSON files to")
+    parser.add_argument("--combined", action="store_true",
+                        help="write one set of files keyed by document name, rather "
+                             "than one set per document")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not use the pandoc output cache")
+    args = parser.parse_args(argv)
+
+    results = process_many(args.files, args.bib, not args.no_cache, workers=args.jobs)
+    written = write_many(results, args.output_dir, args.combined)
+
+    print("Processed {} files, wrote {} outputs".format(len(results), len(written)))
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+""" Asset syncing for compile.py: copies the images and compiled files into the
+    website. Files that already match their destination are skipped, the others
+    are linked (or reflinked) where the filesystem allows it and copied
+    otherwise, across a thread pool. """
+
+
+import os
+import re
+import shutil
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ltcstm.manifest import same_contents
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+DEFAULT_WORKERS = 8
+
+# ioctl that clones the extents of one file into another (Linux, btrfs/XFS)
+FICLONE = 0x40049409
+
+# Numbered backreferences and conditionals, which would refer to the wrong group
+# once the patterns are combined
+NUMBERED_GROUP_REGEX = re.compile(r"\\[1-9]|\(\?\([0-9]")
+
+
+class Dispatcher(object):
+    """ Decides where each compiled file is sent, from a list of (pattern,
+        destination) rules. The first rule whose pattern matches the start of the
+        file name wins, as with trying each re.match in turn, but all of the patterns
+        are tried in a single match of one combined regex. """
+
+    def __init__(self, rules):
+        self.destinations = [destination for pattern, destination in rules]
+        self.patterns = [re.compile(pattern) for pattern, destination in rules]
+
+        self.combined = None
+
+        if any(NUMBERED_GROUP_REGEX.search(pattern.pattern) for pattern in self.patterns):
+            return
+
+        try:
+            self.combined = re.compile("|".join(
+                "(?P<_rule{}>{})".format(i, pattern.pattern)
+                for i, pattern in enumerate(self.patterns)
+            ))
+        except re.error:  # e.g. the same group name in two patterns
+            pass
+
+
+    def destination(self, name):
+        """ Returns the destination directory for the file called name, or None if no
+            rule matches it """
+        if self.combined is None:
+            for pattern, destination in zip(self.patterns, self.destinations):
+                if pattern.match(name):
+                    return destination
+
+            return None
+
+        match = self.combined.match(name)
+
+        if match is None:
+            return None
+
+        # The rule groups are the outermost, so close last
+        return self.destinations[int(match.lastgroup[len("_rule"):])]
+
+
+def up_to_date(source, destination):
+    """ Checks whether destination already holds the contents of source: it is the
+        same file (e.g. a hardlink), or has the same size and modification time, or
+        the same contents """
+    try:
+        stat_source = os.stat(source)
+        stat_destination = os.stat(destination)
+    except OSError:
+        return False
+
+    if stat_source.st_size != stat_destination.st_size:
+        return False
+    elif os.path.samestat(stat_source, stat_destination):
+        return True
+    elif stat_source.st_mtime_ns == stat_destination.st_mtime_ns:
+        return True
+
+    return same_contents(source, destination)
+
+
+def reflink(source, destination):
+    """ Makes destination a copy-on-write clone of source. Raises OSError if the
+        filesystem does not support it. """
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform")
+
+    with open(source, "rb") as file_source, open(destination, "wb") as file_destination:
+        fcntl.ioctl(file_destination.fileno(), FICLONE, file_source.fileno())
+
+    shutil.copystat(source, destination)
+
+    return
+
+
+def place(source, destination, link=True):
+    """ Puts the contents of source at destination, via a temporary file so that
+        readers never see part of it. Tries a hardlink (if link is True), then a
+        reflink, then a plain copy that keeps the modification time. """
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(destination) or ".",
+                                         suffix=".tmp")
+    os.close(handle)
+
+    try:
+        done = False
+
+        if link:
+            try:
+                os.remove(temporary)
+                os.link(source, temporary)
+                done = True
+            except OSError:  # e.g. on another filesystem
+                pass
+
+        if not done:
+            try:
+                reflink(source, temporary)
+            except OSError:
+                shutil.copy2(source, temporary)
+
+        os.replace(temporary, destination)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+        raise
+
+    return
+
+
+def sync_file(source, destination, link=True):
+    """ Copies source to destination unless it is already up to date. Returns True
+        if a copy was made. """
+    if up_to_date(source, destination):
+        return False
+
+    place(source, destination, link)
+
+    return True
+
+
+def sync_files(pairs, link=True, workers=DEFAULT_WORKERS):
+    """ Syncs each (source, destination) in pairs across a thread pool. Returns the
+        list of pairs that were copied, in order. """
+    pairs = list(pairs)
+
+    with ThreadPoolExecutor(max(1, workers)) as executor:
+        copied = list(executor.map(lambda pair: sync_file(pair[0], pair[1], link), pairs))
+
+    return [pair for pair, was_copied in zip(pairs, copied) if was_copied]
@@ -0,0 +1,162 @@
+""" Pre-parsed bibliographies. Converting the BibTeX file to CSL-JSON once, rather
+    than letting pandoc-citeproc re-parse it for every conversion, saves a large
+    part of each pandoc run for big bibliographies.
+
+    Conversions are stored in a directory under the hash of the bibliography
+    contents (see ltcstm.cache.bib_digest, which only re-reads the file when its
+    size or modification time change). Bibliographies can also be pruned to the
+    references that a document cites. """
+
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+
+import pypandoc
+
+from ltcstm.cache import DEFAULT_CACHE_DIR, bib_digest
+
+
+DEFAULT_BIB_DIR = os.path.join(DEFAULT_CACHE_DIR, "bib")
+
+# LaTeX citation commands (\cite, \citep, \citet*, \parencite[p. 1]{...}, ...)
+LATEX_CITE_REGEX = re.compile(r"\\[a-zA-Z]*cite[a-zA-Z]*\*?(?:\[[^\]]*\]){0,2}\{([^}]*)\}")
+
+# pandoc markdown citations (@key, [@key, p. 1; @other])
+MARKDOWN_CITE_REGEX = re.compile(r"@([A-Za-z0-9_][\w:.#$%&\-+?<>~/]*)")
+KEY_PUNCTUATION = ":.#$%&-+?<>~/"
+
+# Digests of the bibliographies that could not be converted, so that we do not try
+# again for every document
+unconvertible = set()
+
+
+def bib2json_commands():
+    """ Commands that convert the BibTeX file given as their last argument to
+        CSL-JSON on stdout, in order of preference """
+    return [
+        ["pandoc-citeproc", "--bib2json"],
+        [pypandoc.get_pandoc_path(), "--from=biblatex", "--to=csljson"],
+    ]
+
+
+def write_atomic(filename, text):
+    """ Writes text to filename via a temporary file, so readers never see part of it """
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+
+    with os.fdopen(handle, "w", encoding="utf-8") as file:
+        file.write(text)
+
+    os.replace(temporary, filename)
+
+    return
+
+
+def get_csl_json(bib, directory=DEFAULT_BIB_DIR, commands=None):
+    """ Returns the path of the CSL-JSON conversion of the bibliography, bib,
+        converting it if it has not been seen before.
+
+        Raises OSError if none of the commands (see bib2json_commands) succeed. """
+    digest = bib_digest(bib)
+
+    if not digest:
+        raise OSError("Bibliography {} does not exist".format(bib))
+    elif digest in unconvertible:
+        raise OSError("Unable to convert {} to CSL-JSON".format(bib))
+
+    path = os.path.join(directory, "{}.json".format(digest))
+
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+
+    try:
+        commands = commands if commands is not None else bib2json_commands()
+    except OSError:  # pandoc is not installed
+        commands = []
+
+    for command in commands:
+        try:
+            output = subprocess.run(command + [bib], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, check=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            continue
+
+        write_atomic(path, output.decode("utf-8"))
+
+        return path
+
+    unconvertible.add(digest)
+
+    raise OSError("Unable to convert {} to CSL-JSON".format(bib))
+
+
+def cited_keys(text, format="latex"):
+    """ Finds the citation keys used in text, a LaTeX or (pandoc) markdown document.
+
+        Returns a set of keys, or None if the document cites everything (with
+        \\nocite{*}). Markdown keys are returned both with and without any trailing
+        punctuation, as pandoc leaves that out of the key. """
+    keys = set()
+
+    if format in ("latex", "tex"):
+        for match in LATEX_CITE_REGEX.finditer(text):
+            keys.update(key.strip() for key in match.group(1).split(","))
+
+        if "*" in keys:
+            return None
+    else:
+        for match in MARKDOWN_CITE_REGEX.finditer(text):
+            key = match.group(1)
+            keys.add(key)
+            keys.add(key.rstrip(KEY_PUNCTUATION))
+
+    keys.discard("")
+
+    return keys
+
+
+def prune(csl_json, keys, directory=DEFAULT_BIB_DIR):
+    """ Writes the references of csl_json (a CSL-JSON file) whose ids are in keys to a
+        new file in directory and returns its path. """
+    digest = hashlib.sha256()
+
+    for part in [os.path.basename(csl_json)] + sorted(keys):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+
+    path = os.path.join(directory, "{}.json".format(digest.hexdigest()))
+
+    if os.path.exists(path):
+        return path
+
+    with open(csl_json, "r", encoding="utf-8") as file:
+        references = json.load(file)
+
+    write_atomic(path, json.dumps([x for x in references if x.get("id") in keys]))
+
+    return path
+
+
+def prepare_bibliography(bib, text=None, format="latex", prune_keys=False,
+                         directory=DEFAULT_BIB_DIR):
+    """ Returns the bibliography file to give to pandoc in place of bib: its cached
+        CSL-JSON conversion, pruned to the keys cited in text if prune_keys is True.
+
+        Falls back to bib itself if it cannot be converted. """
+    try:
+        path = get_csl_json(bib, directory)
+    except OSError:
+        return bib
+
+    if prune_keys and text is not None:
+        keys = cited_keys(text, format)
+
+        if keys is not None:
+            path = prune(path, keys, directory)
+
+    return path
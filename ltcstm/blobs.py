@@ -0,0 +1,56 @@
+""" Content-addressed store for the markdown bodies written by the NDJSON output
+    (see ltcstm.io.write_ndjson). Each blob is stored once, under the hash of its
+    contents, however many records refer to it. """
+
+
+import hashlib
+import os
+import tempfile
+
+
+class BlobStore(object):
+    """ Stores text blobs as <directory>/<sha256>.md """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.known = set()  # keys known to be stored, to save a stat per put
+
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    def key(self, text):
+        """ The hash that text is stored under """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+    def path(self, key):
+        """ Location of the blob stored under key """
+        return os.path.join(self.directory, "{}.md".format(key))
+
+
+    def put(self, text):
+        """ Stores text, unless it is already present, and returns its key """
+        key = self.key(text)
+
+        if key in self.known:
+            return key
+
+        path = self.path(key)
+
+        if not os.path.exists(path):
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                file.write(text)
+
+            os.replace(temporary, path)
+
+        self.known.add(key)
+
+        return key
+
+
+    def get(self, key):
+        """ Returns the text stored under key """
+        with open(self.path(key), "r", encoding="utf-8") as file:
+            return file.read()
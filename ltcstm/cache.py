@@ -0,0 +1,291 @@
+""" Persistent, content-addressed cache for pandoc conversions.
+
+    Entries are keyed by a hash of everything that can change pandoc's output
+    (input text, bibliography contents, arguments and tool versions) and are
+    evicted least-recently-used first once the cache grows past max_size. """
+
+
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+import pypandoc
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ltcstm")
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+
+def executable(name):
+    """ Resolves the command, name, to the file that would be run, or returns an
+        empty string if it is not installed """
+    path = shutil.which(name)
+
+    return os.path.realpath(path) if path else ""
+
+
+def pandoc_executable():
+    """ Resolves the pandoc that pypandoc runs: $PYPANDOC_PANDOC, pandoc on the PATH
+        or the copy bundled with pypandoc. Unlike pypandoc.get_pandoc_path, this does
+        not run pandoc. """
+    bundled = os.path.join(os.path.dirname(os.path.realpath(pypandoc.__file__)),
+                           "files", "pandoc")
+
+    for name in [os.environ.get("PYPANDOC_PANDOC", "pandoc"), bundled]:
+        path = executable(os.path.expanduser(name))
+
+        if path:
+            return path
+
+    return ""
+
+
+def run_version(path):
+    """ Returns the version string reported by the executable, path, or an empty
+        string if it cannot be run """
+    try:
+        output = subprocess.run([path, "--version"], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=False).stdout
+    except OSError:  # not executable
+        return ""
+
+    return output.decode("utf-8", "replace").strip()
+
+
+def read_bytes(filename):
+    """ Reads filename as bytes, returning b"" if it does not exist """
+    try:
+        with open(filename, "rb") as file:
+            return file.read()
+    except OSError:
+        return b""
+
+
+@functools.lru_cache(maxsize=32)
+def file_digest(filename, size, mtime_ns):
+    """ Hashes the contents of filename; size and mtime_ns are part of the memo key """
+    return hashlib.sha256(read_bytes(filename)).hexdigest()
+
+
+def bib_digest(filename):
+    """ Hashes the bibliography, filename. The hash is remembered until the file's
+        size or modification time change, so a bibliography shared by many
+        documents is only read once. Returns "" if it does not exist. """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return ""
+
+    return file_digest(filename, stat.st_size, stat.st_mtime_ns)
+
+
+class PandocCache(object):
+    """ On-disk LRU cache of pandoc outputs. Each entry is stored as a single file
+        in directory, and its modification time is used as the last-access time.
+
+        The total size of the entries is counted once, when the cache is opened, and
+        then kept up to date, so that the directory is only scanned again when it
+        has to be trimmed. """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.size = sum(size for _, size, _ in self.entries())
+        self.versions = {}
+
+
+    def key(self, text, to, format, extra_args, bib=""):
+        """ Builds the content-addressed key for a single pandoc conversion """
+        digest = hashlib.sha256()
+
+        parts = [text, to, format, "\0".join(extra_args), self.tool_versions(extra_args)]
+
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+
+        if bib:
+            digest.update(bib_digest(bib).encode("utf-8"))
+
+        return digest.hexdigest()
+
+
+    def tool_version(self, path):
+        """ Returns the version reported by the executable, path, or an empty string
+            if it is not installed.
+
+            The version is stored in the cache directory under the executable's
+            path, size and modification time, so that the tool is only run again
+            once it has been replaced, and a rebuild from the cache never starts
+            it. """
+        if not path:
+            return ""
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ""
+
+        signature = "{}\0{}\0{}".format(path, stat.st_size, stat.st_mtime_ns)
+
+        if signature in self.versions:
+            return self.versions[signature]
+
+        filename = os.path.join(self.directory, "{}.version".format(
+            hashlib.sha256(signature.encode("utf-8")).hexdigest()))
+
+        try:
+            with open(filename, "r", encoding="utf-8") as file:
+                version = file.read()
+        except OSError:  # not seen before
+            version = run_version(path)
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                file.write(version)
+
+            os.replace(temporary, filename)
+
+        self.versions[signature] = version
+
+        return version
+
+
+    def tool_versions(self, extra_args):
+        """ Describes the pandoc version and that of every filter (-F) in extra_args """
+        versions = ["pandoc {}".format(self.tool_version(pandoc_executable()))]
+
+        for flag, name in zip(extra_args, extra_args[1:]):
+            if flag in ("-F", "--filter"):
+                versions.append("{} {}".format(name, self.tool_version(executable(name))))
+
+        return "\n".join(versions)
+
+
+    def path(self, key):
+        """ Location of the cache entry for key """
+        return os.path.join(self.directory, "{}.out".format(key))
+
+
+    def get(self, key):
+        """ Returns the cached output for key, or None on a miss """
+        path = self.path(key)
+
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                output = file.read()
+        except OSError:  # cache miss
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return output
+
+
+    def put(self, key, output):
+        """ Stores output under key, evicting old entries if the cache has grown past
+            max_size """
+        path = self.path(key)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+        with os.fdopen(handle, "w", encoding="utf-8") as file:
+            file.write(output)
+
+        try:
+            self.size -= os.path.getsize(path)
+        except OSError:  # a new entry
+            pass
+
+        self.size += os.path.getsize(temporary)
+
+        os.replace(temporary, path)
+
+        if self.size > self.max_size:
+            self.evict()
+
+        return
+
+
+    def entries(self):
+        """ Returns (mtime, size, path) for every entry, oldest first """
+        output = []
+
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".out"):
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:  # removed by a concurrent process
+                continue
+
+            output.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return sorted(output)
+
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in max_size.
+            The directory is scanned again, to count the entries written by other
+            processes. """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            total -= size
+
+        self.size = total
+
+        return
+
+
+    def clear(self):
+        """ Removes every entry from the cache """
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        self.size = 0
+
+        return
+
+
+@functools.lru_cache(maxsize=None)
+def default_cache():
+    """ The PandocCache in the default location. It is opened (and its size counted)
+        once per process and shared, rather than once per document. """
+    return PandocCache()
+
+
+def get_cache(cache):
+    """ Normalises the cache argument accepted by MasterData and friends:
+
+        + True - use the shared PandocCache in the default location
+        + False/None - do not cache
+        + PandocCache - used as-is """
+    if cache is True:
+        return default_cache()
+    elif not cache:
+        return None
+    else:
+        return cache
@@ -0,0 +1,490 @@
+""" Converter backends that all pandoc conversions go through, and batch
+    conversion of many small fragments (keypoints, questions) in a single run.
+
+    The default backend runs one pandoc subprocess per conversion through pypandoc.
+    PandocServerPool instead keeps a pool of long-lived `pandoc server` processes
+    so that the start-up cost is only paid once; use set_converter to make it the
+    default.
+
+    Every converter also has an asynchronous counterpart, aconvert, for running many
+    conversions concurrently on one asyncio event loop. """
+
+
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing.util
+import os
+import queue
+import re
+import socket
+import subprocess
+import time
+import urllib.error
+import urllib.request
+
+import pypandoc
+
+import ltcstm.regex
+
+
+FORMAT_ALIASES = {"md": "markdown", "tex": "latex"}
+
+
+class Converter(object):
+    """ Converts text with a new pandoc subprocess for every call (via pypandoc) """
+
+    def convert(self, text, to, format, extra_args=()):
+        """ Converts text from format to to """
+        return pypandoc.convert_text(text, to, format=format, extra_args=list(extra_args))
+
+
+    def command(self, to, format, extra_args=()):
+        """ The pandoc command line used by aconvert """
+        return [
+            pypandoc.get_pandoc_path(),
+            "--from", FORMAT_ALIASES.get(format, format),
+            "--to", FORMAT_ALIASES.get(to, to),
+        ] + list(extra_args)
+
+
+    async def aconvert(self, text, to, format, extra_args=()):
+        """ Converts text from format to to in a pandoc subprocess started with
+            asyncio, so that the event loop is free while pandoc runs """
+        # Finding pandoc runs it (once) to check it works
+        loop = asyncio.get_running_loop()
+        command = await loop.run_in_executor(None, self.command, to, format, extra_args)
+
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+        stdout, stderr = await process.communicate(text.encode("utf-8"))
+
+        if process.returncode != 0:
+            raise RuntimeError(
+                "Pandoc died with exitcode \"{}\" during conversion: {}".format(
+                    process.returncode, stderr.decode("utf-8", "replace")
+                )
+            )
+
+        return stdout.decode("utf-8")
+
+
+    def close(self):
+        """ Releases any resources held by the converter """
+        return
+
+
+def get_free_port():
+    """ Asks the OS for a free local TCP port """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class PandocServerWorker(object):
+    """ A single `pandoc server` process listening on a local port. The process is
+        only started when the worker is first used (see PandocServerPool.request). """
+
+    def __init__(self, command=("pandoc", "server"), startup_timeout=10.0):
+        self.command = list(command)
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.owner = None
+        self.url = ""
+
+
+    def start(self):
+        """ (Re)starts the server process and waits until it is healthy """
+        self.stop()
+
+        port = get_free_port()
+        self.url = "http://127.0.0.1:{}".format(port)
+        self.process = subprocess.Popen(self.command + ["--port", str(port)],
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+        self.owner = os.getpid()
+
+        deadline = time.monotonic() + self.startup_timeout
+
+        while not self.healthy():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise OSError("Unable to start {}".format(" ".join(self.command)))
+
+            time.sleep(0.05)
+
+        return
+
+
+    def alive(self):
+        """ Checks that the process has not exited """
+        if self.process is None:
+            return False
+        elif os.getpid() != self.owner:
+            # A forked copy of the pool (e.g. in a process pool) cannot wait on the
+            # server; it shares it, and relies on the health check on failure.
+            return True
+
+        return self.process.poll() is None
+
+
+    def healthy(self):
+        """ Checks that the process is alive and answering requests """
+        if not self.alive():
+            return False
+
+        try:
+            with urllib.request.urlopen(self.url + "/version", timeout=1.0) as response:
+                return response.status == 200
+        except (OSError, urllib.error.URLError):
+            return False
+
+
+    def request(self, options, timeout):
+        """ Sends a conversion request (see the pandoc-server documentation) """
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(options).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                result = json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as error:  # the conversion itself failed
+            raise RuntimeError(error.read().decode("utf-8", "replace"))
+
+        if isinstance(result, str):  # older servers return only the error string
+            raise RuntimeError(result)
+
+        return result["output"]
+
+
+    def stop(self):
+        """ Stops the server process """
+        if self.process is not None and os.getpid() == self.owner and self.process.poll() is None:
+            self.process.terminate()
+
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+        self.process = None
+
+        return
+
+
+class PandocServerPool(Converter):
+    """ Pool of long-lived `pandoc server` workers. At most one conversion is sent to
+        each worker at a time, so the number of workers bounds the concurrency.
+
+        Workers are started when they are first needed, health-checked before use and
+        restarted if they have died.
+
+        The bound only holds within one process. Worker processes (e.g. of a
+        ProcessPoolExecutor) should each get a pool of their own, of a share of the
+        servers: see init_servers and share_servers.
+
+        pandoc server does not run external filters itself. Conversions with filters
+        are split into a request that reads the text to pandoc's JSON AST, the
+        filters (which read and write the AST on stdin and stdout, as they do under
+        pandoc), and a request that writes the AST out. pandoc-citeproc is mapped
+        to the built-in citeproc. Conversions with arguments that cannot be
+        expressed as requests are sent to the fallback converter. """
+
+    def __init__(self, workers=2, command=("pandoc", "server"), timeout=120.0,
+                 fallback=None):
+        self.timeout = timeout
+        self.fallback = fallback if fallback is not None else Converter()
+        self.command = command
+
+        self.workers = [PandocServerWorker(command) for _ in range(workers)]
+        self.idle = queue.Queue()
+
+        for worker in self.workers:
+            self.idle.put(worker)
+
+
+    def options(self, text, to, format, extra_args):
+        """ Translates pandoc command line arguments to a pandoc-server request.
+
+            Returns options, filters: the request, and the names of the filters
+            (including pandoc-citeproc) in the order that they are given. Both are
+            None if the arguments cannot be expressed as a request. """
+        options = {
+            "text": text,
+            "from": FORMAT_ALIASES.get(format, format),
+            "to": FORMAT_ALIASES.get(to, to),
+        }
+        filters = []
+        args = list(extra_args)
+
+        while args:
+            arg = args.pop(0)
+
+            if arg == "--mathjax":
+                options["html-math-method"] = "mathjax"
+            elif arg in ("-F", "--filter") and args:
+                filters.append(args.pop(0))
+            elif arg.startswith("--bibliography="):
+                filename = arg.split("=", 1)[1]
+
+                with open(filename, "rb") as file:
+                    contents = base64.b64encode(file.read()).decode("ascii")
+
+                options.setdefault("files", {})[filename] = contents
+                options.setdefault("bibliography", []).append(filename)
+            else:
+                return None, None
+
+        return options, filters
+
+
+    def request(self, options):
+        """ Sends a request to one of the idle workers """
+        worker = self.idle.get()
+
+        try:
+            if not worker.alive():
+                worker.start()
+
+            try:
+                return worker.request(options, self.timeout)
+            except OSError:
+                # Connection problems: restart the worker if it is no longer healthy
+                # and retry once
+                if not worker.healthy():
+                    worker.start()
+
+                return worker.request(options, self.timeout)
+        finally:
+            self.idle.put(worker)
+
+
+    def run_filter(self, name, to, ast):
+        """ Runs the external filter, name, on the JSON AST, as pandoc would """
+        try:
+            result = subprocess.run([name, to], input=ast.encode("utf-8"),
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    timeout=self.timeout, check=True)
+        except OSError as error:  # filter not installed
+            raise RuntimeError("Unable to run filter {}: {}".format(name, error))
+        except subprocess.CalledProcessError as error:
+            raise RuntimeError("Filter {} failed: {}".format(
+                name, error.stderr.decode("utf-8", "replace")))
+
+        return result.stdout.decode("utf-8")
+
+
+    def convert(self, text, to, format, extra_args=()):
+        """ Converts text on the workers, running any filters in between reading and
+            writing it """
+        options, filters = self.options(text, to, format, extra_args)
+
+        if options is None:
+            return self.fallback.convert(text, to, format, extra_args)
+
+        if filters in ([], ["pandoc-citeproc"]):
+            if filters:
+                options["citeproc"] = True
+
+            return self.request(options)
+
+        # The bibliography is only needed by citeproc, and the writer options by
+        # the last request
+        citeproc = {key: options.pop(key) for key in ("files", "bibliography")
+                    if key in options}
+        citeproc.update({"from": "json", "to": "json", "citeproc": True})
+
+        ast = self.request({"text": text, "from": options["from"], "to": "json"})
+
+        for name in filters:
+            if name == "pandoc-citeproc":
+                citeproc["text"] = ast
+                ast = self.request(citeproc)
+            else:
+                ast = self.run_filter(name, options["to"], ast)
+
+        options.update({"text": ast, "from": "json"})
+
+        return self.request(options)
+
+
+    async def aconvert(self, text, to, format, extra_args=()):
+        """ Converts text on one of the idle workers. The blocking request is made on
+            the event loop's default executor; the idle queue still bounds the number
+            of requests in flight. """
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(None, self.convert, text, to, format, extra_args)
+
+
+    def close(self):
+        """ Stops all of the workers """
+        for worker in self.workers:
+            worker.stop()
+
+        return
+
+
+DEFAULT_CONVERTER = Converter()
+_converter = DEFAULT_CONVERTER
+
+
+def get_converter():
+    """ Returns the converter used when none is given explicitly """
+    return _converter
+
+
+def set_converter(converter):
+    """ Sets the converter used when none is given explicitly. Pass None to restore
+        the subprocess-per-conversion default. Returns the previous converter. """
+    global _converter
+
+    previous = _converter
+    _converter = converter if converter is not None else DEFAULT_CONVERTER
+
+    return previous
+
+
+def share_servers(servers, jobs):
+    """ The number of pandoc servers each of jobs processes gets, so that between
+        them they run no more than servers (unless there are more jobs than servers,
+        as each gets at least one) """
+    return max(1, servers // max(1, jobs))
+
+
+def init_servers(workers, command=("pandoc", "server")):
+    """ Initializer for worker processes (e.g. of a ProcessPoolExecutor): runs their
+        conversions on a PandocServerPool of their own, of workers servers, which
+        are stopped when the process exits """
+    pool = PandocServerPool(workers, command=command)
+    set_converter(pool)
+
+    # The worker processes of a ProcessPoolExecutor do not run atexit handlers
+    multiprocessing.util.Finalize(pool, pool.close, exitpriority=0)
+
+    return
+
+
+def convert(text, to, format, extra_args=(), converter=None):
+    """ Converts a single string, text, from format to to """
+    converter = converter if converter is not None else get_converter()
+
+    return converter.convert(text, to, format, extra_args)
+
+
+async def aconvert(text, to, format, extra_args=(), converter=None, semaphore=None):
+    """ Asynchronous version of convert. If semaphore (an asyncio.Semaphore) is given,
+        it is held for the duration of the conversion, bounding the number of pandoc
+        processes that run at once. """
+    converter = converter if converter is not None else get_converter()
+
+    if semaphore is None:
+        return await converter.aconvert(text, to, format, extra_args)
+
+    async with semaphore:
+        return await converter.aconvert(text, to, format, extra_args)
+
+
+def get_sentinel(fragments):
+    """ Grabs a sentinel word that does not appear in any of the fragments. Plain
+        alphanumeric words survive pandoc untouched in every reader and writer that
+        we use. """
+    digest = hashlib.sha1("\0".join(fragments).encode("utf-8")).hexdigest()
+
+    for seed in ltcstm.regex.seed_candidates(digest):
+        sentinel = "LTCSTM{}FRAGMENT".format(seed)
+
+        if not any(sentinel in fragment for fragment in fragments):
+            return sentinel
+
+    raise ValueError("Unable to find a sentinel that is not present in the fragments")
+
+
+def join_fragments(fragments, sentinel):
+    """ Joins the fragments into a single document, each preceded by its own
+        sentinel paragraph """
+    parts = []
+
+    for i, fragment in enumerate(fragments):
+        parts.append("{}{}".format(sentinel, i))
+        parts.append(fragment)
+
+    return "\n\n".join(parts)
+
+
+def split_output(output, sentinel, number):
+    """ Splits the converted document back into its fragments. Returns None if the
+        sentinels did not survive conversion intact. """
+    regex = r"(?:<p>)?{}(\d+)(?:</p>)?".format(sentinel)
+    split = re.split(regex, output)
+
+    indices = [int(x) for x in split[1::2]]
+
+    if indices != list(range(number)):
+        return None
+
+    fragments = []
+
+    for fragment in split[2::2]:
+        fragment = fragment.strip("\n")
+        fragments.append(fragment + "\n" if fragment else "")
+
+    return fragments
+
+
+def convert_batch(fragments, to, format, extra_args=(), converter=None):
+    """ Converts every string in fragments with a single pandoc run and returns the
+        list of converted strings, in order.
+
+        The fragments are joined into one document separated by sentinel paragraphs,
+        which are used to split the output again. If the sentinels are mangled (for
+        example by an unclosed environment in one of the fragments) we fall back to
+        converting each fragment individually. """
+    fragments = list(fragments)
+
+    if not fragments:
+        return []
+
+    sentinel = get_sentinel(fragments)
+    output = convert(join_fragments(fragments, sentinel), to, format, extra_args, converter)
+
+    split = split_output(output, sentinel, len(fragments))
+
+    if split is None:
+        split = [convert(fragment, to, format, extra_args, converter)
+                 for fragment in fragments]
+
+    return split
+
+
+async def aconvert_batch(fragments, to, format, extra_args=(), converter=None,
+                         semaphore=None):
+    """ Asynchronous version of convert_batch. The per-fragment fallback conversions
+        run concurrently, bounded by semaphore. """
+    fragments = list(fragments)
+
+    if not fragments:
+        return []
+
+    sentinel = get_sentinel(fragments)
+    output = await aconvert(join_fragments(fragments, sentinel), to, format, extra_args,
+                            converter, semaphore)
+
+    split = split_output(output, sentinel, len(fragments))
+
+    if split is None:
+        split = await asyncio.gather(*[
+            aconvert(fragment, to, format, extra_args, converter, semaphore)
+            for fragment in fragments
+        ])
+
+    return list(split)
@@ -0,0 +1,48 @@
+""" Slicing of the HTML produced by compile.py. The sections and lectures are
+    delimited by <!-- uid --> comments, whose positions are all found in a single
+    scan of the document. """
+
+
+import bisect
+import re
+
+
+COMMENT_REGEX = re.compile(r"<!-- (\S+) -->")
+
+
+class CommentIndex(object):
+    """ Index of the positions of the <!-- uid --> comments in html, used to cut out
+        the text between pairs of them without searching the document again. """
+
+    def __init__(self, html):
+        self.html = html
+        self.starts = {}
+        self.ends = {}
+
+        for match in COMMENT_REGEX.finditer(html):
+            uid = match.group(1)
+
+            self.starts.setdefault(uid, []).append(match.start())
+            self.ends.setdefault(uid, []).append(match.end())
+
+
+    def between(self, begin, end):
+        """ Returns the text between the first <!-- begin --> comment and the first
+            <!-- end --> comment after it, as
+
+                re.search("<!-- begin -->(.*?)<!-- end -->", html, re.DOTALL)
+
+            would, or None if there is no such text. """
+
+        if begin not in self.ends or end not in self.starts:
+            return None
+
+        start = self.ends[begin][0]
+        ends = self.starts[end]
+
+        i = bisect.bisect_left(ends, start)
+
+        if i == len(ends):
+            return None
+
+        return self.html[start:ends[i]]
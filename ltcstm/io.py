@@ -1,56 +1,286 @@
 """ Input-output operations and wrappers for the parser """
 
-from ltcstm.storage import MasterData, split_data
+from ltcstm.blobs import BlobStore
+from ltcstm.cache import get_cache
+from ltcstm.storage import MasterData, iter_records, split_data
+from ltcstm.timing import TimingCollector, get_collector
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import glob
 import json
+import os
 
 
-def parse_string(string, bib=""):
-    """ Parses a string and returns the associated MasterData object """
+DEFAULT_CONCURRENCY = 8
 
-    return MasterData(string, bib)
 
+def parse_string(string, bib="", cache=True, collector=None, lazy=False):
+    """ Parses a string and returns the associated MasterData object. With lazy=True
+        nothing is computed until it is used (see MasterData). """
 
-def parse_file(filename, bib=""):
-    """ Parses the file 'filename' and returns the associated MasterData object """
+    return MasterData(string, bib, cache, collector=collector, lazy=lazy)
+
+
+def parse_file(filename, bib="", cache=True, collector=None, converter=None):
+    """ Parses the file 'filename' and returns the associated MasterData object. The
+        file is streamed through the preprocessor rather than read in one go. """
     with open(filename, "r") as file:
-        input_data = file.read()
+        return MasterData(file, bib, cache, converter=converter, collector=collector)
+
 
-    return parse_string(input_data, bib)
+def timed_split(master_data, collector):
+    """ split_data, recorded as a stage of collector """
+    collector = get_collector(collector)
 
+    with collector.stage("split_data", len(master_data.output_text)):
+        return split_data(master_data)
 
-def grab_data(string, bib=""):
+
+def grab_data(string, bib="", cache=True, collector=None):
     """ Grabs two dictionaries and a list:
         + secs - the sections (with structure section[name][data] = the markdown, and assc. kps)
         + lecs - the lectures (same as above)
         + kps - the keypoints """
 
-    return split_data(parse_string(string, bib))
+    return timed_split(parse_string(string, bib, cache, collector), collector)
 
 
-def process_file(filename, bib=""):
+def process_file(filename, bib="", cache=True, collector=None, converter=None):
     """ Grabs two dictionaries and a list:
         + secs - the sections (with structure section[name][data] = the markdown, and assc. kps)
         + lecs - the lectures (same as above)
         + kps - the keypoints """
 
-    return split_data(parse_file(filename, bib))
+    return timed_split(parse_file(filename, bib, cache, collector, converter), collector)
+
+
+async def aparse_string(string, bib="", cache=True, collector=None, semaphore=None):
+    """ Asynchronous version of parse_string. If semaphore is given it bounds the
+        number of pandoc processes that run at once. """
+
+    return await MasterData.acreate(string, bib, cache, collector=collector,
+                                    semaphore=semaphore)
+
+
+async def aparse_file(filename, bib="", cache=True, collector=None, semaphore=None):
+    """ Asynchronous version of parse_file """
+    with open(filename, "r") as file:
+        return await MasterData.acreate(file, bib, cache, collector=collector,
+                                        semaphore=semaphore)
+
+
+async def aprocess_file(filename, bib="", cache=True, collector=None, semaphore=None):
+    """ Asynchronous version of process_file """
+    master_data = await aparse_file(filename, bib, cache, collector, semaphore)
+
+    return timed_split(master_data, collector)
+
+
+async def aprocess_files(filenames, bib="", cache=True, limit=DEFAULT_CONCURRENCY):
+    """ Processes every file in filenames concurrently, with at most limit pandoc
+        processes running at once.
+
+        Returns a list of (secs, lecs, kps), as from process_file, in the order of
+        filenames. """
+    semaphore = asyncio.Semaphore(limit)
+
+    return await asyncio.gather(*[
+        aprocess_file(filename, bib, cache, semaphore=semaphore) for filename in filenames
+    ])
 
 
 def parse_to_files(filename, bib="",
                    fn_sections="sections.json",
                    fn_lectures="lectures.json",
-                   fn_kps="kps.json"):
-    """ Opens the file, filename, and does a processing run and saves them as json files. """
+                   fn_kps="kps.json",
+                   cache=True,
+                   collector=None,
+                   fn_timings=None):
+    """ Opens the file, filename, and does a processing run and saves them as json files.
+
+        Pass cache=False to bypass the pandoc output cache. If fn_timings is given,
+        a JSON report of the time spent in each stage is written there too. """
+
+    if fn_timings is not None and collector is None:
+        collector = TimingCollector()
+
+    secs, lecs, kps = process_file(filename, bib, cache, collector)
+
+    with get_collector(collector).stage("write_json") as record:
+        with open(fn_sections, "w") as file:
+            json.dump(secs, file)
+
+        with open(fn_lectures, "w") as file:
+            json.dump(lecs, file)
+
+        with open(fn_kps, "w") as file:
+            json.dump(kps, file)
+
+        record["markers"] = {"lectures": len(lecs), "sections": len(secs), "keypoints": len(kps)}
+
+    if fn_timings is not None:
+        collector.dump(fn_timings)
+
+    return
+
+
+def write_ndjson(master_data, file, blobs=None):
+    """ Writes the keypoints, sections and lectures of master_data to the open file,
+        one JSON record per line, as they are produced (see
+        ltcstm.storage.iter_records). If blobs (a BlobStore) is given the markdown
+        of the sections and lectures is written there instead, once.
+
+        Returns the number of records written. """
+    number = 0
+
+    for number, record in enumerate(iter_records(master_data, blobs), 1):
+        file.write(json.dumps(record))
+        file.write("\n")
+
+    return number
+
+
+def read_ndjson(filename, blobs=None):
+    """ Generator over the records written by write_ndjson. If blobs is given, the
+        data of records that refer to blobs is filled back in. """
+    with open(filename, "r") as file:
+        for line in file:
+            record = json.loads(line)
+
+            if blobs is not None and "blobs" in record:
+                record["data"] = "\n".join(blobs.get(key) for key in record.pop("blobs"))
 
-    secs, lecs, kps = process_file(filename, bib)
+            yield record
 
-    with open(fn_sections, "w") as file:
-        json.dump(secs, file)
 
-    with open(fn_lectures, "w") as file:
-        json.dump(lecs, file)
+def parse_to_ndjson(filename, bib="", fn_output="document.ndjson", blob_dir=None,
+                    cache=True, collector=None):
+    """ Opens the file, filename, does a processing run and streams the result to
+        fn_output as NDJSON (see write_ndjson). If blob_dir is given, the markdown
+        bodies are stored there in a BlobStore. """
 
-    with open(fn_kps, "w") as file:
-        json.dump(kps, file)
+    master_data = parse_file(filename, bib, cache, collector)
+    blobs = BlobStore(blob_dir) if blob_dir is not None else None
+
+    with get_collector(collector).stage("write_ndjson") as record:
+        with open(fn_output, "w") as file:
+            number = write_ndjson(master_data, file, blobs)
+
+        record["markers"] = {"records": number}
+
+    return
+
+
+def expand_filenames(patterns):
+    """ Expands the glob patterns in patterns, in order and without duplicates.
+        Patterns that match nothing are kept as they are, so that a missing file is
+        reported when it is opened. """
+    filenames = []
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else []
+
+        for filename in matches or [pattern]:
+            if filename not in filenames:
+                filenames.append(filename)
+
+    return filenames
+
+
+# Resources shared by all of the documents handled by one worker process
+_worker_state = {}
+
+
+def init_worker(bib, cache, converter):
+    """ Sets up a worker process of process_many """
+    _worker_state["bib"] = bib
+    _worker_state["cache"] = get_cache(cache)
+    _worker_state["converter"] = converter
 
     return
+
+
+def process_in_worker(filename):
+    """ process_file, in a worker process of process_many """
+    return process_file(filename, _worker_state["bib"], _worker_state["cache"],
+                        converter=_worker_state["converter"])
+
+
+def process_many(patterns, bib="", cache=True, converter=None, workers=1):
+    """ Processes every tex file matching patterns (file names or glob patterns) with
+        the same bibliography, bib.
+
+        The bibliography is checked once up front, and a single cache and converter
+        are shared by all of the documents. With workers > 1 the documents are
+        fanned out across that many processes, each of which sets up its own cache
+        and is handed the converter (which must be picklable, unless the processes
+        are forked).
+
+        Returns a dictionary of filename -> (secs, lecs, kps), as from process_file,
+        in the order of the files. """
+    filenames = expand_filenames(patterns)
+
+    if bib and not os.path.isfile(bib):
+        raise FileNotFoundError("Bibliography {} does not exist".format(bib))
+
+    if workers > 1 and len(filenames) > 1:
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(bib, cache, converter)) as executor:
+            results = list(executor.map(process_in_worker, filenames))
+    else:
+        cache = get_cache(cache)
+        results = [process_file(filename, bib, cache, converter=converter)
+                   for filename in filenames]
+
+    return dict(zip(filenames, results))
+
+
+def output_stem(filename):
+    """ The name that the outputs of the document filename are stored under """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def write_many(results, directory=".", combined=False):
+    """ Writes the results of process_many as JSON files in directory.
+
+        If combined is True, sections.json, lectures.json and kps.json each map the
+        document name (its file name without the extension) to its data. Otherwise
+        each document gets its own <name>.sections.json, <name>.lectures.json and
+        <name>.kps.json.
+
+        Returns the list of files written. """
+    stems = {}
+
+    for filename in results:
+        stem = output_stem(filename)
+
+        if stem in stems:
+            raise ValueError("{} and {} would be written to the same files".format(
+                stems[stem], filename
+            ))
+
+        stems[stem] = filename
+
+    os.makedirs(directory, exist_ok=True)
+
+    kinds = ["sections", "lectures", "kps"]
+
+    if combined:
+        outputs = {
+            os.path.join(directory, "{}.json".format(kind)): {
+                output_stem(filename): result[i] for filename, result in results.items()
+            }
+            for i, kind in enumerate(kinds)
+        }
+    else:
+        outputs = {
+            os.path.join(directory, "{}.{}.json".format(output_stem(filename), kind)): result[i]
+            for filename, result in results.items()
+            for i, kind in enumerate(kinds)
+        }
+
+    for output, data in outputs.items():
+        with open(output, "w") as file:
+            json.dump(data, file)
+
+    return list(outputs)
@@ -0,0 +1,125 @@
+""" Build manifest used by compile.py for incremental rebuilds. It records the
+    hashes of the inputs of the previous build and the outputs generated from them
+    so that unchanged chapters can be skipped. """
+
+
+import hashlib
+import json
+import os
+
+
+def hash_bytes(data):
+    """ Hashes a bytes object """
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(filename, block_size=1 << 20):
+    """ Hashes the contents of filename, returning "" if it does not exist """
+    digest = hashlib.sha256()
+
+    try:
+        with open(filename, "rb") as file:
+            for block in iter(lambda: file.read(block_size), b""):
+                digest.update(block)
+    except OSError:
+        return ""
+
+    return digest.hexdigest()
+
+
+def same_contents(first, second, block_size=1 << 20):
+    """ Checks whether two files have identical contents, comparing sizes first """
+    try:
+        if os.path.getsize(first) != os.path.getsize(second):
+            return False
+
+        with open(first, "rb") as file_a, open(second, "rb") as file_b:
+            while True:
+                block_a = file_a.read(block_size)
+
+                if block_a != file_b.read(block_size):
+                    return False
+                elif not block_a:
+                    return True
+    except OSError:
+        return False
+
+
+def write_if_changed(filename, text):
+    """ Writes text to filename unless it already holds exactly text. Returns True if
+        the file was written.
+
+        The text is written to a temporary file that then replaces filename, so that
+        readers never see part of it, and so that any hardlinks to the old file (see
+        ltcstm.assets) keep the old contents until they are synced. """
+    try:
+        with open(filename, "r") as file:
+            if file.read() == text:
+                return False
+    except OSError:  # does not exist yet
+        pass
+
+    temporary = "{}.{}.tmp".format(filename, os.getpid())
+
+    with open(temporary, "w") as file:
+        file.write(text)
+
+    os.replace(temporary, filename)
+
+    return True
+
+
+class BuildManifest(object):
+    """ Stores, as JSON in directory:
+
+        + config - hash of the configuration file
+        + bib - hash of the bibliography
+        + chapters - per-chapter records (input hash, outputs, etc.) from compile.py
+
+        Copied files are not recorded: ltcstm.assets compares them with their
+        destinations instead. """
+
+    filename = ".build_manifest.json"
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.filename)
+
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):  # first build, or a corrupt manifest
+            data = {}
+
+        self.config = data.get("config", "")
+        self.bib = data.get("bib", "")
+        self.chapters = data.get("chapters", {})
+
+
+    def invalidate(self, config, bib):
+        """ Drops all chapter records if the configuration or bibliography hashes have
+            changed since the last build, then stores the new hashes. """
+        if config != self.config or bib != self.bib:
+            self.chapters = {}
+
+        self.config = config
+        self.bib = bib
+
+        return
+
+
+    def save(self):
+        """ Writes the manifest back to disk """
+        data = {
+            "config": self.config,
+            "bib": self.bib,
+            "chapters": self.chapters,
+        }
+
+        temporary = self.path + ".tmp"
+
+        with open(temporary, "w") as file:
+            json.dump(data, file)
+
+        os.replace(temporary, self.path)
+
+        return
@@ -1,6 +1,6 @@
 """ Formatting functions for various markdown to HTML conversions """
 
-import pypandoc
+from ltcstm.convert import convert_batch
 
 
 def insert_lecture_divs(orig_txt, lexer):
@@ -30,9 +30,10 @@ def get_key_points_html(key, lexer, extra_class=[]):
         return ''
     else:
         txt = '<div class="{}">\n<h2>\nKey Points\n</h2>'.format(classes)
-        for keypt in lexer.keypoints[key]:
+        # one pandoc run for all of the keypoints
+        for kptxt in convert_batch(lexer.keypoints[key], 'html', 'latex'):
             div = '''<div class="key-point">{kptxt}</div>'''.format(
-                kptxt=pypandoc.convert(keypt, 'html', format='tex')
+                kptxt=kptxt
             )
             txt += div
         txt += '</div>'
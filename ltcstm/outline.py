@@ -0,0 +1,101 @@
+""" Outline of a document (its lectures, sections and keypoints) found straight from
+    the LaTeX source, without running pandoc. This is cheap enough to run on every
+    request, e.g. to build the site navigation.
+
+    Line ranges refer to the lines of the source (counting from zero, including the
+    pdfonly blocks) and are half-open: a part runs from its marker up to, but not
+    including, the next marker of the same kind. They are approximate in that the
+    pandoc output of a part need not have the same number of lines. """
+
+
+import ltcstm.regex
+
+
+def new_part(name, line_number):
+    """ The outline entry for a lecture or section starting at line_number """
+    return {
+        "name": name,
+        "start": line_number,
+        "end": None,
+        "keypoints": [],
+    }
+
+
+def get_outline(text):
+    """ Builds the outline of text, a string or an iterable of lines (e.g. an open
+        file), in a single pass. Returns a dictionary:
+
+        + lectures - [{name, start, end, keypoints, sections}]
+        + sections - [{name, start, end, keypoints, lecture}]
+        + keypoints - [{text, line, lecture, section}]
+
+        Keypoints and the sections of each lecture are given as indices in the
+        keypoints and sections lists, and each section and keypoint refers to the
+        lecture (and section) that it appears in by index, or None if it appears
+        before the first one. """
+
+    if isinstance(text, str):
+        text = text.splitlines()
+
+    lectures = []
+    sections = []
+    keypoints = []
+
+    number_of_lines = 0
+
+    for line_number, line in ltcstm.regex.iter_numbered_lines(text):
+        number_of_lines = line_number + 1
+
+        if "%%\\" not in line:
+            continue
+
+        for kind, payload, _ in ltcstm.regex.scan_markers(line):
+            lecture = len(lectures) - 1 if lectures else None
+            section = len(sections) - 1 if sections else None
+
+            if kind == "lecture":
+                if lectures:
+                    lectures[-1]["end"] = line_number
+
+                part = new_part(payload, line_number)
+                part["sections"] = []
+
+                lectures.append(part)
+            elif kind == "section":
+                if sections:
+                    sections[-1]["end"] = line_number
+
+                part = new_part(payload, line_number)
+                part["lecture"] = lecture
+
+                if lecture is not None:
+                    lectures[lecture]["sections"].append(len(sections))
+
+                sections.append(part)
+            else:
+                for parts, index in [(lectures, lecture), (sections, section)]:
+                    if index is not None:
+                        parts[index]["keypoints"].append(len(keypoints))
+
+                keypoints.append({
+                    "text": payload,
+                    "line": line_number,
+                    "lecture": lecture,
+                    "section": section,
+                })
+
+    for parts in [lectures, sections]:
+        if parts:
+            parts[-1]["end"] = number_of_lines
+
+    return {
+        "lectures": lectures,
+        "sections": sections,
+        "keypoints": keypoints,
+    }
+
+
+def outline_file(filename):
+    """ Builds the outline of the file, filename, streaming it line by line """
+    with open(filename, "r") as file:
+        return get_outline(file)
@@ -1,23 +1,178 @@
 """ Contains regex replacement functions for each individual item """
 
 
+import functools
+import hashlib
 import uuid
 import re
 
 
+LECTURE_REGEX = re.compile(r"%%\\lecture{.*}")
+SECTION_REGEX = re.compile(r"%%\\section{.*}")
+KEYPOINT_REGEX = re.compile(r"%%\\keypoint{.*}")
+
+# The above with groups, in the order that they take precedence: group 1 is the kind
+# of marker, group 2 its payload
+MARKER_REGEXES = [
+    re.compile(r"%%\\(lecture)\{(.*)\}"),
+    re.compile(r"%%\\(section)\{(.*)\}"),
+    re.compile(r"%%\\(keypoint)\{(.*)\}"),
+]
+
+# Payloads of markers that have been extracted on their own
+PAYLOAD_REGEX = re.compile(r"\{(.*)\}")
+KEYPOINT_PAYLOAD_REGEX = re.compile(r"keypoint\{(.*)\}")
+
+UID_REGEX = re.compile(r"(?:LEC|SEC|KEY)-[0-9a-f]{8}-[0-9]{6,}")
+
+
+def get_seed(lines, length=8, digits=False):
+    """ Grabs a seed for the UIDs of a document, given as a sequence of lines (which
+        is read twice), from the hash of its contents. The seed does not appear
+        anywhere in the document, so neither can any UID containing it.
+
+        The seed is length hexadecimal characters, or decimal digits if digits is
+        True. """
+    if not isinstance(lines, (list, tuple)):
+        lines = list(lines)
+
+    digest = hashlib.sha256()
+
+    for line in lines:
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\0")
+
+    if digits:
+        source = str(int(digest.hexdigest(), 16))
+    else:
+        source = digest.hexdigest()
+
+    for seed in seed_candidates(source, length):
+        if not any(seed in line for line in lines):
+            return seed
+
+    raise ValueError("Unable to find a seed that is not present in the document")
+
+
+def seed_candidates(source, length=8):
+    """ Yields every length character window of source (a hash of the document), in
+        turn, as candidate seeds """
+    for i in range(0, len(source) - length + 1):
+        yield source[i:i+length]
+
+
+def fixed_seed(attempt=0, length=8):
+    """ Grabs the placeholder seed for the UIDs of a document that is being streamed,
+        on the given attempt. The placeholders do not depend on the document, so the
+        UIDs can be made before it has all been read, and are replaced with a seed
+        from the hash of its contents once it has. If the output turns out to contain
+        the placeholder elsewhere the document is read again with the placeholder of
+        the next attempt. """
+    return hashlib.sha256("ltcstm-uid-{}".format(attempt).encode("utf-8")).hexdigest()[:length]
+
+
+class UIDGenerator(object):
+    """ Generates the UIDs for a single document, as
+            <prefix><seed>-<ordinal>
+        where the ordinal counts up from zero. The same document (and hence seed)
+        always gets the same UIDs. """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.counter = 0
+
+
+    def __call__(self, prefix=""):
+        uid = "{}{}-{:06d}".format(prefix, self.seed, self.counter)
+        self.counter += 1
+
+        return uid
+
+
 def get_uid(prefix=""):
-    """ Grabs a random unique identifier """
-    return "{}{}".format(prefix, uuid.uuid4())
+    """ Grabs a random unique identifier in the same format as UIDGenerator, for use
+        outside of a document. UIDGenerator should be preferred as it is
+        deterministic. """
+    return UIDGenerator(uuid.uuid4().hex[:8])(prefix)
 
 
-def text_replace(text, initial, final):
-    """ Recursive function to replace a list of initial in a string with another list """
-    replaced = text.replace(initial[0], final[0])
+def build_trie(words):
+    """ Builds a character trie (nested dictionaries) of words. The None key marks
+        the end of a word. """
+    trie = {}
+
+    for word in words:
+        node = trie
+
+        for char in word:
+            node = node.setdefault(char, {})
+
+        node[None] = True
+
+    return trie
 
-    if len(initial) == 1:
-        return replaced
+
+def trie_to_regex(node):
+    """ Converts a trie node to a regex pattern. Runs of single children are collapsed
+        into literals, and shorter words are optional suffixes so the longest word
+        always wins. """
+    terminal = None in node
+    branches = []
+
+    for char in sorted(x for x in node if x is not None):
+        literal = char
+        child = node[char]
+
+        while len(child) == 1 and None not in child:
+            (char, child), = child.items()
+            literal += char
+
+        branches.append(re.escape(literal) + trie_to_regex(child))
+
+    if not branches:
+        return ""
+    elif terminal:
+        return "(?:{})?".format("|".join(branches))
+    elif len(branches) == 1:
+        return branches[0]
     else:
-        return text_replace(replaced, initial[1:], final[1:])
+        return "(?:{})".format("|".join(branches))
+
+
+def compile_items(items):
+    """ Compiles a regex that matches any of the strings in items, longest first """
+    return re.compile(trie_to_regex(build_trie(item for item in items if item)))
+
+
+def multi_replace(text, initial, final):
+    """ Replaces each string in the initial list with the corresponding string in the
+        final list, in a single scan over text.
+
+        As with repeated str.replace, if a string appears more than once in initial
+        only its first replacement is used. Where two strings of initial overlap in
+        the text the longest is replaced. Empty strings are ignored. """
+    replacements = {}
+
+    for old, new in zip(initial, final):
+        if old:
+            replacements.setdefault(old, new)
+
+    if not replacements:
+        return text
+
+    compiled = compile_items(replacements)
+
+    return compiled.sub(lambda match: replacements[match.group(0)], text)
+
+
+def text_replace(text, initial, final):
+    """ Replaces each string in the initial list with the corresponding string in the
+        final list, in order, so later replacements also apply to the output of
+        earlier ones. Use multi_replace to replace them all in a single scan. """
+    for old, new in zip(initial, final):
+        text = text.replace(old, new)
+
+    return text
 
 
 def replace_with_uids(text, items, prefix=""):
@@ -28,75 +183,135 @@ def replace_with_uids(text, items, prefix=""):
         Returns output, uid_list"""
 
     # generate the uids
-    uid_list = [get_uid(prefix) for x in items]
+    generator = UIDGenerator(get_seed([text]))
+    uid_list = [generator(prefix) for x in items]
 
-    try:
-        output = text_replace(text, items, uid_list)
-    except IndexError:  # no replacements to be made
-        output = text
+    output = multi_replace(text, items, uid_list)
 
     return output, uid_list
 
 
+def index_lines(text, regex=UID_REGEX):
+    """ Maps every match of regex in text to the number of the first line that it
+        appears on, in a single pass.
+
+        Returns index, number_of_lines """
+    index = {}
+    number_of_lines = 0
+
+    for number_of_lines, line in enumerate(text.splitlines(), 1):
+        for match in regex.findall(line):
+            index.setdefault(match, number_of_lines - 1)
+
+    return index, number_of_lines
+
+
+@functools.lru_cache(maxsize=128)
+def compile_verbose(regex):
+    """ Compiles (and remembers) regex with the re.VERBOSE flag """
+    return re.compile(regex, re.VERBOSE)
+
+
 def find_items(text, regex):
     """ Quick wrapper over the regex module. Finds items that are associated with regex
-        in text and returns them. """
+        in text and returns them. regex may be a pattern string or a compiled
+        pattern. """
+
+    if isinstance(regex, str):
+        regex = compile_verbose(regex)
+
+    return regex.findall(text)
+
 
-    compiled = re.compile(regex, re.VERBOSE)
+def match_markers(text):
+    """ Finds every lecture, section and keypoint marker in text, returning their
+        matches in the order that they appear.
 
-    return compiled.findall(text)
+        The markers are found as they would be by find_lectures, find_sections and
+        find_keypoints in turn, each on the text with the markers already found
+        removed: each payload runs to the last closing brace on its line, but stops
+        short of any lecture (or, for keypoints, section) marker after it. """
+    matches = []
+
+    for regex in MARKER_REGEXES:
+        for match in regex.finditer(text):
+            matches.append(match)
+            # Blanked out, keeping the offsets, so the next kinds do not see it
+            text = text[:match.start()] + "\0" * (match.end() - match.start()) + \
+                text[match.end():]
+
+    return sorted(matches, key=lambda match: match.start())
+
+
+def scan_markers(text):
+    """ Finds every lecture, section and keypoint marker in text (see match_markers).
+
+        Returns a list of (kind, payload, offset), where kind is one of "lecture",
+        "section" or "keypoint" and offset is the position of the marker in text. """
+
+    return [(match.group(1), match.group(2), match.start())
+            for match in match_markers(text)]
 
 
 def find_lectures(text):
     """ Finds all instances of custom lecture syntax in the text string """
 
-    regex = r"%%\\lecture{.*}"
-
-    return find_items(text, regex)
+    return LECTURE_REGEX.findall(text)
 
 
 def find_sections(text):
     """ Finds all instances of custom section syntax in the text string """
 
-    regex = r"%%\\section{.*}"
-
-    return find_items(text, regex)
+    return SECTION_REGEX.findall(text)
 
 
 def find_keypoints(text):
     """ Finds all keypoints. We actually want to match the whole string as the keypoint extractor
         object deals with our internals. """
 
-    regex = r"%%\\keypoint{.*}"
+    return KEYPOINT_REGEX.findall(text)
 
-    return find_items(text, regex)
 
+def iter_numbered_lines(lines):
+    """ Generator that drops the pdfonly blocks from an iterable of lines (e.g. an open
+        file), yielding (line_number, line) for the lines that are kept. Line numbers
+        count every line of the input from zero, and lines are yielded without their
+        line endings. """
 
-def remove_pdfonly(text):
-    """ We can just kill the pdfonly blocks as they are not relevant to us. To do that, we'll
-        iterate through the text string line by line and remove all references. """
+    pdfonly = False
+    line_number = -1
 
-    split = text.splitlines()
+    for chunk in lines:
+        for line in chunk.splitlines() or [chunk]:
+            line_number += 1
 
-    pdfonly = False
+            if r"%%@pdfonly" in line:
+                pdfonly = True
+
+                continue
+
+            elif r"%%@endpdfonly" in line:
+                pdfonly = False
 
-    output = []
+                continue
 
-    for line in split:
-        if r"%%@pdfonly" in line:
-            pdfonly = True
+            elif pdfonly:  # pdfonly blocks are skipped here.
+                continue
 
-            continue
+            else:
+                yield line_number, line
 
-        elif r"%%@endpdfonly" in line:
-            pdfonly = False
 
-            continue
+def iter_remove_pdfonly(lines):
+    """ Generator that drops the pdfonly blocks from an iterable of lines (e.g. an open
+        file). Lines are yielded without their line endings. """
 
-        elif pdfonly:  # pdfonly blocks are skipped here.
-            continue
+    for _, line in iter_numbered_lines(lines):
+        yield line
 
-        else:
-            output.append(line)
 
-    return "\n".join(output)
+def remove_pdfonly(text):
+    """ We can just kill the pdfonly blocks as they are not relevant to us. To do that, we'll
+        iterate through the text string line by line and remove all references. """
+
+    return "\n".join(iter_remove_pdfonly(text.splitlines()))
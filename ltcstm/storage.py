@@ -7,10 +7,21 @@
 
 from typing import List
 
-import re
-import pypandoc
+import asyncio
+import bisect
+import functools
+import hashlib
+import itertools
 
 import ltcstm.regex
+from ltcstm.bibliography import prepare_bibliography
+from ltcstm.cache import get_cache
+from ltcstm.convert import aconvert, aconvert_batch, convert, convert_batch
+from ltcstm.timing import get_collector
+
+
+# Number of lines of output joined at a time by PreprocessedData
+CHUNK_LINES = 4096
 
 
 def html_output(uid):
@@ -19,6 +30,19 @@ def html_output(uid):
     return "<!-- {} -->".format(uid)
 
 
+def group_keypoints(keypoints, attribute):
+    """ Groups the keypoints by their associated part (attribute is either "section"
+        or "lecture") in a single pass.
+
+        Returns a dictionary of part -> [indices in keypoints] """
+    groups = {}
+
+    for i, keypoint in enumerate(keypoints):
+        groups.setdefault(getattr(keypoint, attribute), []).append(i)
+
+    return groups
+
+
 def split_data(master_data):
     """ Splits the master_data object by lectures and sections
 
@@ -36,34 +60,8 @@ def split_data(master_data):
     # lecs[name][data] = associated markdown
 
 
-    def find_keypoints_section(keypoints, section):
-        """ Find the keypoints that are associated with a section """
-        output = []
-
-        for i, keypoint in enumerate(keypoints):
-            if keypoint.section == section:
-                output.append(i)
-            else:
-                continue
-
-        return output
-
-
-    def find_keypoints_lecture(keypoints, lecture):
-        """ Find the keypoints that are associated with a lecture """
-        output = []
-
-        for i, keypoint in enumerate(keypoints):
-            if keypoint.lecture == lecture:
-                output.append(i)
-            else:
-                continue
-
-        return output
-
-
-    def split_single(markdown, parts, keypoints, find_keypoints):
-        """ find_keypoints is a callable that finds the keypoints associated with the parts """
+    def split_single(markdown, parts, groups):
+        """ groups maps each part to the indices of its associated keypoints """
         output = {}
 
         for item in parts:
@@ -71,7 +69,7 @@ def split_data(master_data):
 
             name = item.name
 
-            kps = find_keypoints(keypoints, item)
+            kps = groups.get(item, [])
 
             output[name] = {
                 "data": "\n".join(lines),
@@ -81,45 +79,170 @@ def split_data(master_data):
         return output
 
 
-    secs = split_single(markdown, sections, keypoints, find_keypoints_section)
-    lecs = split_single(markdown, lectures, keypoints, find_keypoints_lecture)
+    secs = split_single(markdown, sections, group_keypoints(keypoints, "section"))
+    lecs = split_single(markdown, lectures, group_keypoints(keypoints, "lecture"))
     kps = [kp.output_data for kp in keypoints]
 
     return secs, lecs, kps
 
 
+def iter_records(master_data, blobs=None):
+    """ Generator of one plain record (dictionary) per keypoint, section and lecture
+        of master_data, in that order, for streaming output.
+
+        Sections and lectures refer to their keypoints by index. Their markdown is
+        given as data, or, if a BlobStore is given as blobs, as a list of blob keys:
+        the markdown is cut at every section and lecture boundary, so each piece
+        is stored only once even though the sections and lectures overlap, and
+        joining the pieces with newlines gives the data back. """
+
+    markdown = master_data.output_text.splitlines()
+    lectures = master_data.lectures
+    sections = master_data.sections
+    keypoints = master_data.keypoints
+
+    for index, keypoint in enumerate(keypoints):
+        yield {
+            "type": "keypoint",
+            "index": index,
+            "uid": keypoint.uid,
+            "data": keypoint.output_data,
+            "lecture": keypoint.lecture_index,
+            "section": keypoint.section_index,
+        }
+
+    boundaries = sorted({0, len(markdown)} |
+                        {part.start for part in lectures + sections} |
+                        {part.end for part in lectures + sections})
+
+    for kind, parts in [("section", sections), ("lecture", lectures)]:
+        groups = group_keypoints(keypoints, kind)
+
+        for index, part in enumerate(parts):
+            record = {
+                "type": kind,
+                "index": index,
+                "name": part.name,
+                "uid": part.uid,
+                "keypoints": groups.get(part, []),
+            }
+
+            if blobs is None:
+                record["data"] = "\n".join(markdown[part.start:part.end])
+            else:
+                record["blobs"] = []
+                i = bisect.bisect_left(boundaries, part.start)
+
+                while i + 1 < len(boundaries) and boundaries[i] < part.end:
+                    piece = "\n".join(markdown[boundaries[i]:boundaries[i + 1]])
+                    record["blobs"].append(blobs.put(piece))
+                    i += 1
+
+            yield record
+
+
+def marker_counts(data):
+    """ Counts the lectures, sections and keypoints held by a Pre/PostprocessedData """
+    return {
+        "lectures": len(data.lectures),
+        "sections": len(data.sections),
+        "keypoints": len(data.keypoints),
+    }
+
+
+def convert_keypoints(keypoints, converter=None):
+    """ Runs pandoc (latex to markdown) on every keypoint in a single pandoc call,
+        replacing their output_data. """
+
+    converted = convert_batch([kp.output_data for kp in keypoints], "markdown", "latex",
+                              converter=converter)
+
+    for keypoint, output in zip(keypoints, converted):
+        keypoint.output_data = output
+
+    return
+
+
+async def aconvert_keypoints(keypoints, converter=None, semaphore=None):
+    """ Asynchronous version of convert_keypoints """
+
+    converted = await aconvert_batch([kp.output_data for kp in keypoints], "markdown",
+                                     "latex", converter=converter, semaphore=semaphore)
+
+    for keypoint, output in zip(keypoints, converted):
+        keypoint.output_data = output
+
+    return
+
+
 class Keypoint(object):
     """ Basic keypoint storage and extraction class.
 
-        If run_pandoc is taken to be True, pandoc is ran on the internal text.
+        If run_pandoc is taken to be True, pandoc is ran on the internal text. When
+        converting many keypoints prefer convert_keypoints, which uses one pandoc run.
+
+        Position should be given as the line number that the keypoint as found at.
 
-        Position should be given as the line number that the keypoint as found at. """
+        payload is the text inside the keypoint's braces, if it is already known
+        (e.g. from ltcstm.regex.scan_markers); otherwise it is extracted from
+        raw_data.
 
-    def __init__(self, raw_data, uid, position, lecture=None, section=None, run_pandoc=False):
+        lecture_index and section_index are the positions of the lecture and section
+        in their lists (e.g. MasterData.lectures), so that keypoints can be stored
+        without references to the Part objects (see as_dict).
+
+        Keypoints use __slots__ as many thousands of them may be held at once. """
+
+    __slots__ = ("raw_data", "uid", "position", "lecture", "section", "lecture_index",
+                 "section_index", "run_pandoc", "output_data")
+
+    def __init__(self, raw_data, uid, position, lecture=None, section=None, run_pandoc=False,
+                 payload=None, lecture_index=None, section_index=None):
         self.raw_data = raw_data
         self.uid = uid
-        self.html = html_output(uid)
         self.position = position
 
         self.lecture = lecture
         self.section = section
+        self.lecture_index = lecture_index
+        self.section_index = section_index
 
         self.run_pandoc = run_pandoc
 
-        self.output_data = self.extract_keypoint()
+        self.output_data = self.extract_keypoint(payload)
 
 
-    def extract_keypoint(self):
-        """ Extracts the data from the keypoint syntax. """
+    @property
+    def html(self):
+        """ The HTML comment that the uid is replaced with """
+        return html_output(self.uid)
 
-        regex = r"keypoint\{(.*)\}"
 
-        find = re.search(regex, self.raw_data, re.VERBOSE)
+    def as_dict(self):
+        """ The keypoint as a dictionary of plain values, with the lecture and section
+            given by index """
+        return {
+            "raw_data": self.raw_data,
+            "uid": self.uid,
+            "position": self.position,
+            "lecture_index": self.lecture_index,
+            "section_index": self.section_index,
+            "output_data": self.output_data,
+        }
 
-        try:
-            output = find.group(1)
-        except AttributeError:  # no match
-            output = ""
+
+    def extract_keypoint(self, payload=None):
+        """ Extracts the data from the keypoint syntax, unless it is given as payload. """
+
+        if payload is not None:
+            output = payload
+        else:
+            find = ltcstm.regex.KEYPOINT_PAYLOAD_REGEX.search(self.raw_data)
+
+            try:
+                output = find.group(1)
+            except AttributeError:  # no match
+                output = ""
 
         if self.run_pandoc:
             return self.pandoc_raw_data(output)
@@ -130,28 +253,36 @@ class Keypoint(object):
     def pandoc_raw_data(self, text):
         """ Runs pandoc (latex to markdown) on the extracted data string, text """
 
-        return pypandoc.convert(text, "markdown", format="tex")
+        return convert(text, "markdown", "latex")
 
 
 class Part(object):
-    """ Basic class for the storage of sections, lectures, start and end points """
+    """ Basic class for the storage of sections, lectures, start and end points.
+
+        name is the text inside the marker's braces, if it is already known;
+        otherwise it is extracted from input_text. """
+
+    __slots__ = ("name", "start", "end", "uid")
 
-    def __init__(self, input_text, start, end, uid=""):
-        self.name = self.extract_part(input_text)
+    def __init__(self, input_text, start, end, uid="", name=None):
+        self.name = name if name is not None else self.extract_part(input_text)
         self.start = start
         self.end = end
         self.uid = uid
-        self.html = html_output(uid)
 
         return
 
 
+    @property
+    def html(self):
+        """ The HTML comment that the uid is replaced with """
+        return html_output(self.uid)
+
+
     def extract_part(self, input_text):
         """ Extracts the data from the custom syntax. """
 
-        regex = r"\{(.*)\}"
-
-        find = re.search(regex, input_text, re.VERBOSE)
+        find = ltcstm.regex.PAYLOAD_REGEX.search(input_text)
 
         try:
             output = find.group(1)
@@ -161,41 +292,189 @@ class Part(object):
         return output
 
 
+class PartIndex(object):
+    """ Interval index over a list of Part objects, used to find the part that a
+        given line number falls in with a binary search over the start lines. """
+
+    def __init__(self, parts: List[Part]):
+        self.parts = parts
+        self.starts = [part.start for part in parts]
+
+        # Parts are created in document order, so this only fails if some of the
+        # markers were lost; in that case we fall back to a linear search.
+        self.ordered = all(x <= y for x, y in zip(self.starts, self.starts[1:]))
+
+
+    def find(self, line_number: int) -> Part:
+        """ Finds the part that line_number lies strictly within. """
+
+        return self.parts[self.find_index(line_number)]
+
+
+    def find_index(self, line_number: int) -> int:
+        """ Finds the index in parts of the part that line_number lies strictly
+            within. """
+
+        if self.ordered:
+            # The parts tile the document, so only the last part that starts before
+            # line_number can contain it.
+            i = bisect.bisect_left(self.starts, line_number) - 1
+
+            if i >= 0 and self.parts[i].end > line_number:
+                return i
+        else:
+            for i, needle in enumerate(self.parts):
+                if (needle.start < line_number) and (needle.end > line_number):
+                    return i
+
+        # Graceful fallback, we'll stick the keypoint/etc. on the last part.
+
+        return len(self.parts) - 1
+
+
 class PreprocessedData(object):
-    """ Holds the data before processing. """
-    def __init__(self, text):
-        self.text = text
-        rep, self.lectures, self.lecture_uids = self.replace_lectures(text)
-        rep, self.sections, self.section_uids = self.replace_sections(rep)
-        rep, self.keypoints, self.keypoint_uids = self.replace_keypoints(rep)
-        self.output_text = rep
+    """ Holds the data before processing.
+
+        text is either a string or an iterable of lines (such as an open file). If
+        remove_pdfonly is True the pdfonly blocks are dropped as the lines are read.
+
+        The UIDs are deterministic and differ between documents: their seed comes from
+        the hash of the text (see ltcstm.regex.get_seed). So that the lines are only
+        read once, the UIDs are first made with a placeholder seed (see
+        ltcstm.regex.fixed_seed) that is swapped for the real one at the end. In the
+        rare case that the placeholder also appears in the output the text is read
+        again with another, which requires it to be a string or a seekable file
+        (otherwise ValueError is raised). """
+
+    prefixes = {"lecture": "LEC-", "section": "SEC-", "keypoint": "KEY-"}
+
+    def __init__(self, text, remove_pdfonly=False):
+        self.text = text if isinstance(text, str) else None
+        self.remove_pdfonly = remove_pdfonly
+
+        for attempt in itertools.count():
+            placeholder = ltcstm.regex.fixed_seed(attempt)
+            chunks = self.preprocess(self.read_lines(text, attempt), placeholder)
+
+            # Each UID contains the placeholder once, so any other copy came from the
+            # text
+            if sum(chunk.count(placeholder) for chunk in chunks) == self.get_uid.counter:
+                break
+
+        self.set_seed(chunks, placeholder)
+        self.output_text = self.separator.join(chunks)
+
+
+    def read_lines(self, text, attempt):
+        """ Returns the lines of text to read on the given attempt """
+        if isinstance(text, str):
+            return text.splitlines(keepends=True)
+        elif attempt == 0:
+            return text
+        elif hasattr(text, "seek"):
+            text.seek(0)
+            return text
+
+        raise ValueError("The UID seed appears in the document, which cannot be read "
+                         "again; pass it as a string or a seekable file")
+
+
+    def preprocess(self, lines, seed):
+        """ Replaces the markers in lines with UIDs made from seed, in a single pass,
+            and returns the output text as a list of chunks """
+        self.lectures, self.lecture_uids, self.lecture_payloads = [], [], []
+        self.sections, self.section_uids, self.section_payloads = [], [], []
+        self.keypoints, self.keypoint_uids, self.keypoint_payloads = [], [], []
+        self.get_uid = ltcstm.regex.UIDGenerator(seed)
+        self.chars_in = 0
+        self.digest = hashlib.sha256()
+
+        lines = self.count_lines(lines)
+
+        if self.remove_pdfonly:
+            lines = ltcstm.regex.iter_remove_pdfonly(lines)
+            self.separator = "\n"
+        else:
+            self.separator = ""
 
+        # Joined in chunks, as join would first gather every line (each an object of
+        # its own) into a list
+        lines = self.replace_markers(lines)
+        chunks = []
 
-    def replace_lectures(self, text):
-        """ Replaces lectures with appropriate uids. """
-        lectures = ltcstm.regex.find_lectures(text)
+        while True:
+            chunk = list(itertools.islice(lines, CHUNK_LINES))
 
-        replaced, uids = ltcstm.regex.replace_with_uids(text, lectures, "LEC-")
+            if not chunk:
+                break
 
-        return replaced, lectures, uids
+            chunks.append(self.separator.join(chunk))
 
+        return chunks
 
-    def replace_sections(self, text):
-        """ Replaces sections with appropriate uids. """
-        sections = ltcstm.regex.find_sections(text)
 
-        replaced, uids = ltcstm.regex.replace_with_uids(text, sections, "SEC-")
+    def set_seed(self, chunks, placeholder):
+        """ Replaces placeholder, in chunks (in place) and the recorded UIDs, with the
+            seed from the hash of the text: the first candidate that does not appear in
+            the output. A UID never spans two chunks, as it never spans two lines. """
+        for seed in ltcstm.regex.seed_candidates(self.digest.hexdigest()):
+            if not any(seed in chunk for chunk in chunks):
+                break
+        else:
+            raise ValueError("Unable to find a seed that is not present in the document")
+
+        for i, chunk in enumerate(chunks):
+            chunks[i] = chunk.replace(placeholder, seed)
+
+        for kind in self.prefixes:
+            uids = getattr(self, kind + "_uids")
+            uids[:] = [uid.replace(placeholder, seed) for uid in uids]
+
+        self.get_uid.seed = seed
+
+        return
+
+
+    def count_lines(self, lines):
+        """ Generator passing lines through while adding their length to chars_in and
+            their contents to digest """
+        for line in lines:
+            self.chars_in += len(line)
+            self.digest.update(line.encode("utf-8"))
+            yield line
+
+
+    def replace_markers(self, lines):
+        """ Generator that replaces the lecture, section and keypoint markers in each
+            line with appropriate uids, recording them as it goes. Only the lines
+            that contain a marker are scanned, with ltcstm.regex.match_markers. """
+
+        for line in lines:
+            if "%%\\" in line:
+                pieces = []
+                end = 0
+
+                for match in ltcstm.regex.match_markers(line):
+                    pieces.append(line[end:match.start()])
+                    pieces.append(self.record(match))
+                    end = match.end()
+
+                pieces.append(line[end:])
+                line = "".join(pieces)
 
-        return replaced, sections, uids
+            yield line
 
 
-    def replace_keypoints(self, text):
-        """ Replaces keypoints with appropriate uids. """
-        keypoints = ltcstm.regex.find_keypoints(text)
+    def record(self, match):
+        """ Stores the matched marker, its payload and its uid, and returns the uid """
+        kind = match.group(1)
+        uid = self.get_uid(self.prefixes[kind])
 
-        replaced, uids = ltcstm.regex.replace_with_uids(text, keypoints, "KEY-")
+        getattr(self, kind + "s").append(match.group(0))
+        getattr(self, kind + "_uids").append(uid)
+        getattr(self, kind + "_payloads").append(match.group(2))
 
-        return replaced, keypoints, uids
+        return uid
 
 
 class PostprocessedData(object):
@@ -209,31 +488,52 @@ class PostprocessedData(object):
 
         self.pre = pre
         self.markdown = markdown
+        self.line_index = None
 
-        self.lectures = self.categorise_part(pre.lectures, pre.lecture_uids)
-        self.sections = self.categorise_part(pre.sections, pre.section_uids)
-        self.keypoints = self.categorise_keypoints(pre.keypoints, pre.keypoint_uids)
+        self.lectures = self.categorise_part(pre.lectures, pre.lecture_uids,
+                                             pre.lecture_payloads)
+        self.sections = self.categorise_part(pre.sections, pre.section_uids,
+                                             pre.section_payloads)
+        self.keypoints = self.categorise_keypoints(pre.keypoints, pre.keypoint_uids,
+                                                   pre.keypoint_payloads)
 
-        self.output = self.replace_all(self.markdown)
 
+    @functools.cached_property
+    def output(self):
+        """ The markdown with the UIDs replaced by HTML comments, built on first use """
+        return self.replace_all(self.markdown)
 
-    def find_locations(self, text, items):
-        """ Finds the locations of items in text (i.e. their line number) """
 
-        # We can assume that the items are ordered.
+    def index_locations(self, text, items=()):
+        """ Builds the map of marker -> line number for text in a single pass. The
+            index of self.markdown is built once and reused. Any of items that are not
+            UIDs are looked for in a second pass. """
+
+        if text is self.markdown:
+            if self.line_index is None:
+                self.line_index = ltcstm.regex.index_lines(text)
+
+            index, number_of_lines = self.line_index
+        else:
+            index, number_of_lines = ltcstm.regex.index_lines(text)
 
-        list_of_lines = text.splitlines()
-        number_of_lines = len(list_of_lines)
-        line_numbers = []
+        missing = [item for item in items if item not in index]
 
-        # This is really slow
-        for match in items:
-            for i, line in enumerate(list_of_lines):
-                if match in line:
-                    line_numbers.append(i)
-                    break
-                else:
-                    continue
+        if missing:
+            extra, _ = ltcstm.regex.index_lines(text, ltcstm.regex.compile_items(missing))
+            index = dict(index)
+            index.update(extra)
+
+        return index, number_of_lines
+
+
+    def find_locations(self, text, items):
+        """ Finds the locations of items in text (i.e. their line number). Items that
+            cannot be found are skipped. """
+
+        index, number_of_lines = self.index_locations(text, items)
+
+        line_numbers = [index[item] for item in items if item in index]
 
         return line_numbers, number_of_lines
 
@@ -257,15 +557,19 @@ class PostprocessedData(object):
         return [(line_numbers[i], line_numbers[i+1]) for i in range(len(line_numbers) - 1)]
 
 
-    def categorise_part(self, parts, part_uids):
-        """ Creates the part objects from the Part class """
+    def categorise_part(self, parts, part_uids, payloads=None):
+        """ Creates the part objects from the Part class. payloads are the names of
+            the parts, if already extracted. """
         part_output = []
 
         start_stop = self.find_start_stop(self.markdown, part_uids)
 
-        for part, uid, (start, stop) in zip(parts, part_uids, start_stop):
+        if payloads is None:
+            payloads = [None] * len(parts)
+
+        for part, uid, (start, stop), name in zip(parts, part_uids, start_stop, payloads):
             part_output.append(
-                Part(part, start, stop, uid)
+                Part(part, start, stop, uid, name)
             )
 
         return part_output
@@ -275,28 +579,30 @@ class PostprocessedData(object):
         """ Finds the assocaited object in the haystack (of Part objects) that is at line_number.
             This is used to find the lecture and section that each keypoint is associated with """
 
-        for needle in haystack:
-            if (needle.start < line_number) and (needle.end > line_number):
-                return needle
-            else:
-                continue
-
-        # Graceful fallback, we'll stick the keypoint/etc. on the last part.
-
-        return haystack[-1]
+        return PartIndex(haystack).find(line_number)
 
 
-    def categorise_keypoints(self, keypoints, keypoint_uids):
-        """ Creates the keypoint objects from the Keypoint class """
+    def categorise_keypoints(self, keypoints, keypoint_uids, payloads=None):
+        """ Creates the keypoint objects from the Keypoint class. payloads are the
+            texts of the keypoints, if already extracted. """
         keypoint_output = []
         line_numbers, _ = self.find_locations(self.markdown, keypoint_uids)
 
-        for keypoint, uid, line_number in zip(keypoints, keypoint_uids, line_numbers):
-            lecture = self.find_associated(line_number, self.lectures)
-            section = self.find_associated(line_number, self.sections)
+        lectures = PartIndex(self.lectures)
+        sections = PartIndex(self.sections)
+
+        if payloads is None:
+            payloads = [None] * len(keypoints)
+
+        for keypoint, uid, line_number, payload in zip(keypoints, keypoint_uids,
+                                                       line_numbers, payloads):
+            lecture = lectures.find_index(line_number)
+            section = sections.find_index(line_number)
 
             keypoint_output.append(
-                Keypoint(keypoint, uid, line_number, lecture, section)
+                Keypoint(keypoint, uid, line_number, self.lectures[lecture],
+                         self.sections[section], payload=payload, lecture_index=lecture,
+                         section_index=section)
             )
 
         return keypoint_output
@@ -312,73 +618,336 @@ class PostprocessedData(object):
             uids.append(item.uid)
             htmls.append(item.html)
 
-        try:
-            replaced = ltcstm.regex.text_replace(text, uids, htmls)
-        except IndexError:  # No replacements to be made
-            replaced = text
-
-        return replaced
+        return ltcstm.regex.multi_replace(text, uids, htmls)
 
 
     def replace_all(self, text):
         """ Replace all section markers, lecture markers, keypoint markers with their
-            respective HTML comments. """
-
-        text = self.replace_with_html(text, self.lectures)
-        text = self.replace_with_html(text, self.sections)
-        text = self.replace_with_html(text, self.keypoints)
+            respective HTML comments, in a single pass over text. """
 
-        return text
+        return self.replace_with_html(text, self.lectures + self.sections + self.keypoints)
 
 
 class MasterData(object):
     """ Master data object, holds the following data:
 
-        + Input string (text)
+        + Input string (text), if a string rather than an iterable of lines was given
         + Lecture start and end points (lectures)
         + Section start and end points (sections)
         + Keypoints (keypoints)
-        + Output string (output) """
+        + Output string (output)
+
+        Pandoc outputs are stored in a PandocCache; pass cache=False to always
+        run pandoc, or a PandocCache instance to use a non-default location.
+
+        The bibliography, bib, is handed to pandoc in its cached CSL-JSON form (see
+        ltcstm.bibliography). If prune_bib is True it is first pruned to the
+        references that the document cites.
+
+        If pandoc_keypoints is True the keypoints are also converted to markdown,
+        all in one batched pandoc run.
+
+        Conversions go through converter (see ltcstm.convert), or the default
+        converter if it is None.
+
+        Pass a TimingCollector (see ltcstm.timing) as collector to record the time
+        spent in, and the sizes handled by, each stage.
+
+        Use MasterData.acreate to build one from a coroutine; pandoc is then ran as
+        an asyncio subprocess.
+
+        If lazy is True nothing is done up front. Instead each stage (preprocessed,
+        markdown, postprocessed, keypoints and output_text) is ran when it is first
+        needed and remembered. Cheap queries (lecture_names, section_names and
+        keypoint_texts) then never run pandoc. An iterable of lines given as text
+        must remain readable until the first access. """
+
+    def __init__(self, text, bib="", cache=True, pandoc_keypoints=False, converter=None,
+                 collector=None, lazy=False, prune_bib=False):
+        self.configure(text, bib, cache, converter, collector, pandoc_keypoints, lazy,
+                       prune_bib)
+
+        if lazy:
+            self.source = text
+        else:
+            self.store(self.run_compiler(text))
+
+            if pandoc_keypoints:
+                self.run_convert_keypoints(self.keypoints)
+
+
+    @classmethod
+    async def acreate(cls, text, bib="", cache=True, pandoc_keypoints=False,
+                      converter=None, collector=None, semaphore=None, prune_bib=False):
+        """ Asynchronous constructor, taking the same arguments as MasterData. If
+            semaphore (an asyncio.Semaphore) is given it is held while pandoc runs.
+
+            The collector should not be shared with other documents that are being
+            processed concurrently. """
+        self = cls.__new__(cls)
+        self.configure(text, bib, cache, converter, collector, pandoc_keypoints,
+                       prune_bib=prune_bib)
+
+        preprocessed = self.run_preprocess(text)
+
+        with self.collector.stage("pandoc", len(preprocessed.output_text)) as record:
+            markdown = await self.arun_pandoc(preprocessed.output_text, semaphore)
+
+            record["chars_out"] = len(markdown)
+
+        self.store(self.run_postprocess(preprocessed, markdown))
+
+        if pandoc_keypoints:
+            with self.collector.stage("convert_keypoints") as record:
+                record["markers"]["keypoints"] = len(self.keypoints)
 
-    def __init__(self, text, bib=""):
-        self.input_text = text
+                with self.collector.subprocess():
+                    await aconvert_keypoints(self.keypoints, self.converter, semaphore)
+
+        return self
+
+
+    def configure(self, text, bib, cache, converter, collector, pandoc_keypoints=False,
+                  lazy=False, prune_bib=False):
+        """ Stores the options shared by the synchronous and asynchronous constructors """
+        self.input_text = text if isinstance(text, str) else None
         self.bib = bib
+        self.cache = get_cache(cache)
+        self.converter = converter
+        self.collector = get_collector(collector)
+        self.pandoc_keypoints = pandoc_keypoints
+        self.lazy = lazy
+        self.prune_bib = prune_bib
 
-        postprocessed = self.run_compiler(text)
+        return
 
+
+    def store(self, postprocessed):
+        """ Grabs the stages and outputs from the PostprocessedData object """
+        self.preprocessed = postprocessed.pre
+        self.markdown = postprocessed.markdown
+        self.postprocessed = postprocessed
         self.lectures = postprocessed.lectures
         self.sections = postprocessed.sections
         self.keypoints = postprocessed.keypoints
         self.output_text = postprocessed.output
 
+        return
+
+
+    # The stages of lazy mode. In eager mode the stages and outputs are all stored by
+    # __init__ (see store) and these are never used.
+
+    @functools.cached_property
+    def preprocessed(self):
+        """ The document with the pdfonly blocks removed and markers replaced by UIDs """
+        preprocessed = self.run_preprocess(self.source)
+        self.source = None
+
+        return preprocessed
+
+
+    @functools.cached_property
+    def markdown(self):
+        """ The output of the main pandoc run """
+        return self.run_pandoc_stage(self.preprocessed.output_text)
+
+
+    @functools.cached_property
+    def postprocessed(self):
+        """ The located lectures, sections and keypoints """
+        return self.run_postprocess(self.preprocessed, self.markdown)
+
+
+    @functools.cached_property
+    def lectures(self):
+        """ The lecture Parts """
+        return self.postprocessed.lectures
+
+
+    @functools.cached_property
+    def sections(self):
+        """ The section Parts """
+        return self.postprocessed.sections
+
+
+    @functools.cached_property
+    def keypoints(self):
+        """ The Keypoints, converted to markdown if pandoc_keypoints is set """
+        keypoints = self.postprocessed.keypoints
+
+        if self.pandoc_keypoints:
+            self.run_convert_keypoints(keypoints)
+
+        return keypoints
+
+
+    @functools.cached_property
+    def output_text(self):
+        """ The markdown with the UIDs replaced by HTML comments """
+        postprocessed = self.postprocessed
+
+        with self.collector.stage("replace_html", len(postprocessed.markdown)) as record:
+            output = postprocessed.output
+
+            record["chars_out"] = len(output)
+
+        return output
+
+
+    @functools.cached_property
+    def lecture_names(self):
+        """ The names of the lectures. In lazy mode pandoc is not ran to find them. """
+        if self.lazy:
+            return list(self.preprocessed.lecture_payloads)
+
+        return [lecture.name for lecture in self.lectures]
+
+
+    @functools.cached_property
+    def section_names(self):
+        """ The names of the sections. In lazy mode pandoc is not ran to find them. """
+        if self.lazy:
+            return list(self.preprocessed.section_payloads)
+
+        return [section.name for section in self.sections]
+
+
+    @functools.cached_property
+    def keypoint_texts(self):
+        """ The (LaTeX) texts of the keypoints. In lazy mode pandoc is not ran to find
+            them. """
+        if self.lazy:
+            return list(self.preprocessed.keypoint_payloads)
+
+        return [ltcstm.regex.KEYPOINT_PAYLOAD_REGEX.search(keypoint.raw_data).group(1)
+                for keypoint in self.keypoints]
+
 
     def run_compiler(self, text):
-        """ Does the initial replacement run with the PreprocessedData object """
-        text = ltcstm.regex.remove_pdfonly(text)
+        """ Does the initial replacement run with the PreprocessedData object. text
+            may be a string or an iterable of lines. """
+        preprocessed = self.run_preprocess(text)
+        markdown = self.run_pandoc_stage(preprocessed.output_text)
+
+        return self.run_postprocess(preprocessed, markdown)
 
-        preprocessed = PreprocessedData(text)
-        markdown = self.run_pandoc(preprocessed.output_text)
-        postprocessed = PostprocessedData(preprocessed, markdown)
+
+    def run_preprocess(self, text):
+        """ Replaces the markers in text with UIDs and strips the pdfonly blocks """
+        with self.collector.stage("preprocess") as record:
+            preprocessed = PreprocessedData(text, remove_pdfonly=True)
+
+            record["chars_in"] = preprocessed.chars_in
+            record["chars_out"] = len(preprocessed.output_text)
+            record["markers"] = marker_counts(preprocessed)
+
+        return preprocessed
+
+
+    def run_postprocess(self, preprocessed, markdown):
+        """ Locates the UIDs in the pandoc output, markdown. Outside of lazy mode the
+            UIDs are also replaced by HTML comments. """
+        with self.collector.stage("postprocess", len(markdown)) as record:
+            postprocessed = PostprocessedData(preprocessed, markdown)
+
+            if not self.lazy:
+                record["chars_out"] = len(postprocessed.output)
+
+            record["markers"] = marker_counts(postprocessed)
 
         return postprocessed
 
 
-    def run_pandoc(self, text):
-        """ Runs pandoc (LaTeX -> Markdown) on the text string """
+    def run_pandoc_stage(self, text):
+        """ run_pandoc, recorded as the "pandoc" stage """
+        with self.collector.stage("pandoc", len(text)) as record:
+            markdown = self.run_pandoc(text)
+
+            record["chars_out"] = len(markdown)
+
+        return markdown
+
+
+    def run_convert_keypoints(self, keypoints):
+        """ Converts the keypoints to markdown with convert_keypoints """
+        with self.collector.stage("convert_keypoints") as record:
+            record["markers"]["keypoints"] = len(keypoints)
+
+            with self.collector.subprocess():
+                convert_keypoints(keypoints, self.converter)
+
+        return
+
+
+    def pandoc_args(self, text=None):
+        """ The extra arguments given to pandoc for the LaTeX -> markdown run of text """
         if self.bib:
-            bib = ["--bibliography={}".format(self.bib)]
+            bibliography = prepare_bibliography(self.bib, text, "latex", self.prune_bib)
+            bib = ["--bibliography={}".format(bibliography)]
         else:
             bib = []
 
-        extra_args = [
+        return [
             "--mathjax",
             "-F",
             "pandoc-crossref",
             "-F",
             "pandoc-citeproc"] + bib
 
+
+    def lookup(self, text, extra_args):
+        """ Looks up the pandoc output for text in the cache.
+
+            Returns key, output; output is None on a miss and both are None if the
+            cache is disabled. """
+        if self.cache is None:
+            return None, None
+
+        key = self.cache.key(text, "markdown", "latex", extra_args, self.bib)
+
+        return key, self.cache.get(key)
+
+
+    def run_pandoc(self, text):
+        """ Runs pandoc (LaTeX -> Markdown) on the text string """
+        extra_args = self.pandoc_args(text)
+        key, cached = self.lookup(text, extra_args)
+
+        if cached is not None:
+            return cached
+
         print("Running Pandoc (LaTeX -> markdown)")
 
-        output_data = pypandoc.convert_text(text, "markdown", format="latex", extra_args=extra_args)
+        with self.collector.subprocess():
+            output_data = convert(text, "markdown", "latex", extra_args, self.converter)
+
+        if key is not None:
+            self.cache.put(key, output_data)
+
+        return output_data
+
+
+    async def arun_pandoc(self, text, semaphore=None):
+        """ Asynchronous version of run_pandoc. The bibliography conversion, the tool
+            versions in the cache key (both of which run subprocesses the first time)
+            and the cache itself are used on the event loop's default executor, so
+            the loop is never blocked. """
+        loop = asyncio.get_running_loop()
+
+        extra_args = await loop.run_in_executor(None, self.pandoc_args, text)
+        key, cached = await loop.run_in_executor(None, self.lookup, text, extra_args)
+
+        if cached is not None:
+            return cached
+
+        print("Running Pandoc (LaTeX -> markdown)")
+
+        with self.collector.subprocess():
+            output_data = await aconvert(text, "markdown", "latex", extra_args,
+                                         self.converter, semaphore)
+
+        if key is not None:
+            await loop.run_in_executor(None, self.cache.put, key, output_data)
 
         return output_data
@@ -0,0 +1,93 @@
+""" Instrumentation for the compiler. A TimingCollector records, for each stage of a
+    build, the wall time, the time spent waiting on subprocesses (pandoc), the input
+    and output sizes (in characters) and the number of markers handled. """
+
+
+import contextlib
+import json
+import time
+
+
+class TimingCollector(object):
+    """ Collects one record (a dictionary) per stage. If callback is given it is
+        called with each record as soon as its stage finishes. """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.records = []
+        self.open = []
+
+
+    @contextlib.contextmanager
+    def stage(self, name, chars_in=None):
+        """ Context manager timing the stage name. The record is yielded so that the
+            stage can fill in chars_in, chars_out and markers. """
+        record = {
+            "stage": name,
+            "wall": 0.0,
+            "subprocess": 0.0,
+            "chars_in": chars_in,
+            "chars_out": None,
+            "markers": {},
+        }
+
+        self.open.append(record)
+        start = time.perf_counter()
+
+        try:
+            yield record
+        finally:
+            record["wall"] = time.perf_counter() - start
+            self.open.pop()
+            self.records.append(record)
+
+            if self.callback is not None:
+                self.callback(record)
+
+
+    @contextlib.contextmanager
+    def subprocess(self):
+        """ Adds the time spent in the block to the subprocess time of the innermost
+            open stage """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            if self.open:
+                self.open[-1]["subprocess"] += time.perf_counter() - start
+
+
+    def report(self):
+        """ Summarises the records as a JSON-ready dictionary """
+        return {
+            "stages": self.records,
+            "wall": sum(record["wall"] for record in self.records),
+            "subprocess": sum(record["subprocess"] for record in self.records),
+        }
+
+
+    def dump(self, filename):
+        """ Writes the report to filename as JSON """
+        with open(filename, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+        return
+
+
+class NullCollector(TimingCollector):
+    """ Collector that records nothing, used when no instrumentation is requested """
+
+    @contextlib.contextmanager
+    def stage(self, name, chars_in=None):
+        yield {"markers": {}}
+
+
+    @contextlib.contextmanager
+    def subprocess(self):
+        yield
+
+
+def get_collector(collector):
+    """ Returns collector, or a NullCollector if it is None """
+    return collector if collector is not None else NullCollector()
@@ -0,0 +1,97 @@
+""" Single-pass tokenizer for the marked-up LaTeX read by compile.py, which replaces
+    its PLY lexer and parser. The tokens are the same (KEY, TEXT, PDFONLYBEGIN and
+    PDFONLYEND, matched with the same regular expressions in the same order) and
+    parse builds the same nested blocks as the PLY grammar, but without generating
+    parser tables on each call and in linear time. """
+
+
+import re
+
+
+# The PLY token rules, in the order in which PLY tried them
+TOKEN_RULES = [
+    ("KEY", r"%%\\(?P<key>\w+)\{(?P<value>.*)\}"),
+    ("PDFONLYBEGIN", r"%%@pdfonly"),
+    ("PDFONLYEND", r"%%@endpdfonly"),
+    ("TEXT", r"(?:(?:\\%)|(?:[^%\\]+)|(?:\\[^%])|(?:%[^%])|(?:%%[^\\@]))+"),
+]
+
+TOKEN_REGEX = re.compile("|".join(
+    "(?P<{}>{})".format(name, pattern) for name, pattern in TOKEN_RULES
+))
+
+
+def tokenize(text, get_uid, register=None):
+    """ Generates the (type, value, position) tokens of text, where the values are
+        those of the PLY lexer:
+
+        + KEY - (key, value, uid) for %%\\key{value}, with uid from get_uid()
+        + TEXT - ("TEXT", text)
+        + PDFONLYBEGIN - ("PDFONLYBEGIN", "") for %%@pdfonly
+        + PDFONLYEND - ("PDFONLYEND", None) for %%@endpdfonly
+
+        register(key, value, uid) is called for each KEY as it is found.
+
+        Raises ValueError at the first character that no token matches. """
+    match_token = TOKEN_REGEX.match
+    position = 0
+
+    while position < len(text):
+        match = match_token(text, position)
+
+        if match is None:
+            raise ValueError("Illegal character {!r} at index {}".format(text[position],
+                                                                         position))
+
+        kind = match.lastgroup
+
+        if kind == "TEXT":
+            value = ("TEXT", match.group())
+        elif kind == "KEY":
+            key, payload = match.group("key", "value")
+            uid = get_uid()
+
+            if register is not None:
+                register(key, payload, uid)
+
+            value = (key, payload, uid)
+        elif kind == "PDFONLYBEGIN":
+            value = ("PDFONLYBEGIN", "")
+        else:
+            value = ("PDFONLYEND", None)
+
+        yield kind, value, position
+
+        position = match.end()
+
+    return
+
+
+def parse(text, get_uid, register=None):
+    """ Returns the blocks of text, as the PLY grammar did: a list of the TEXT and
+        KEY token values, in which each %%@pdfonly ... %%@endpdfonly is replaced by
+        ("PDFONLY", blocks). pdfonly blocks may be nested.
+
+        Raises ValueError if the pdfonly blocks are not balanced. """
+    blocks = []
+    stack = []
+
+    for kind, value, position in tokenize(text, get_uid, register):
+        if kind == "PDFONLYBEGIN":
+            stack.append((blocks, position))
+            blocks = []
+        elif kind == "PDFONLYEND":
+            if not stack:
+                raise ValueError("%%@endpdfonly without %%@pdfonly at index {}".format(
+                    position))
+
+            inner = blocks
+            blocks = stack.pop()[0]
+            blocks.append(("PDFONLY", inner))
+        else:
+            blocks.append(value)
+
+    if stack:
+        raise ValueError("%%@pdfonly at index {} is never closed".format(stack[-1][1]))
+
+    return blocks
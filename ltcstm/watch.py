@@ -0,0 +1,92 @@
+""" Polling file watcher used by compile.py --watch. Directories are scanned for
+    changes in the size or modification time of the files below them, and bursts of
+    changes (an editor saving several files, or writing one in several steps) are
+    collected into a single set before they are reported. """
+
+
+import os
+import time
+
+
+DEFAULT_INTERVAL = 0.25  # seconds between scans
+DEFAULT_DEBOUNCE = 0.3  # seconds without changes that end a burst
+
+
+def snapshot(paths):
+    """ Returns {filename: (size, mtime_ns)} for every file in paths, searching
+        directories recursively. Paths that do not exist are left out. """
+    files = {}
+    todo = list(paths)
+
+    while todo:
+        path = todo.pop()
+
+        try:
+            if os.path.isdir(path):
+                with os.scandir(path) as entries:
+                    todo.extend(entry.path for entry in entries)
+            else:
+                stat = os.stat(path)
+                files[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:  # removed while scanning
+            continue
+
+    return files
+
+
+def changes(old, new):
+    """ Returns the set of files that were created, removed or modified between two
+        snapshots """
+    return {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
+
+class Watcher(object):
+    """ Watches paths (files or directories) by polling them every interval
+        seconds. sleep and clock can be replaced, e.g. for testing. """
+
+    def __init__(self, paths, interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.paths = list(paths)
+        self.interval = interval
+        self.debounce = debounce
+        self.sleep = sleep
+        self.clock = clock
+
+        self.files = snapshot(self.paths)
+
+
+    def poll(self):
+        """ Returns the files that have changed since the last poll """
+        files = snapshot(self.paths)
+        changed = changes(self.files, files)
+        self.files = files
+
+        return changed
+
+
+    def wait(self):
+        """ Blocks until something changes, then until nothing has changed for
+            debounce seconds, and returns all of the files that changed """
+        changed = set()
+
+        while not changed:
+            self.sleep(self.interval)
+            changed = self.poll()
+
+        last_change = self.clock()
+
+        while self.clock() - last_change < self.debounce:
+            self.sleep(self.interval)
+            more = self.poll()
+
+            if more:
+                changed |= more
+                last_change = self.clock()
+
+        return changed
+
+
+    def __iter__(self):
+        """ Yields the sets of changed files, forever """
+        while True:
+            yield self.wait()
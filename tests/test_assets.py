@@ -0,0 +1,70 @@
+""" Tests for assets.py """
+
+import os
+import tempfile
+
+from ltcstm.assets import Dispatcher, sync_files, up_to_date
+
+
+def test_dispatcher():
+    """ Tests that the combined regex picks the same destination as trying each
+        pattern in turn """
+
+    rules = [
+        (r".*\.html", "notes"),
+        (r"_Lecture_.*", "lectures"),
+        (r".*\.(yaml|json)", "data"),
+        (r"(a)\1", "repeated"),  # cannot be combined
+    ]
+
+    test_data = ["_Lecture_1.html", "_Lecture_1.tex", "info.yaml", "image.png", "aa"]
+
+    expected_outcomes = ["notes", "lectures", "data", None, "repeated"]
+
+    for i, dispatcher in enumerate([Dispatcher(rules[:3]), Dispatcher(rules)]):
+        assert (dispatcher.combined is None) == (i == 1), "failed on test 1.{}".format(i)
+
+        for test, expected, j in zip(test_data, expected_outcomes, range(len(test_data))):
+            if expected == "repeated" and i == 0:
+                expected = None
+
+            assert dispatcher.destination(test) == expected, "failed on test 2.{}".format(j)
+
+    return
+
+
+def test_sync_files():
+    """ Tests that files are copied (or linked) once, and again after changing """
+
+    with tempfile.TemporaryDirectory() as directory:
+        pairs = []
+
+        for name in ["a.png", "b.png"]:
+            source = os.path.join(directory, name)
+
+            with open(source, "w") as file:
+                file.write(name)
+
+            pairs.append((source, os.path.join(directory, "copy_" + name)))
+
+        for link in [True, False]:
+            for source, destination in pairs:
+                if os.path.exists(destination):
+                    os.remove(destination)
+
+            assert sync_files(pairs, link) == pairs, "failed on test 1.0"
+            assert sync_files(pairs, link) == [], "failed on test 1.1"
+            assert all(up_to_date(*pair) for pair in pairs), "failed on test 1.2"
+
+        # Replace the source, as an editor would, rather than writing in place
+        os.remove(pairs[0][0])
+
+        with open(pairs[0][0], "w") as file:
+            file.write("changed")
+
+        assert sync_files(pairs) == pairs[:1], "failed on test 2.0"
+
+        with open(pairs[0][1], "r") as file:
+            assert file.read() == "changed", "failed on test 2.1"
+
+    return
@@ -0,0 +1,59 @@
+""" Tests for bibliography.py """
+
+import json
+import os
+import sys
+import tempfile
+
+from ltcstm.bibliography import cited_keys, get_csl_json, prepare_bibliography, prune
+
+
+def test_cited_keys():
+    """ Tests finding the citations in LaTeX and markdown """
+
+    test_data = [
+        [r"See \cite{a, b} and \citep[p.~2]{c}, \parencite*[][]{d}.", "latex"],
+        [r"\nocite{*} \cite{a}", "latex"],
+        ["As @smith99 says [@doe:2000, p. 3; @roe.], mail x@y", "markdown"],
+    ]
+
+    expected_outcomes = [
+        {"a", "b", "c", "d"},
+        None,
+        {"smith99", "doe:2000", "roe.", "roe", "y"},
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert cited_keys(test[0], test[1]) == expected, "failed on test 1.{}".format(i)
+
+    return
+
+
+def test_get_csl_json():
+    """ Tests the cached conversion, with a stand-in for pandoc-citeproc, and pruning """
+
+    references = [{"id": "a", "title": "A"}, {"id": "b", "title": "B"}]
+    command = [sys.executable, "-c", "print({!r})".format(json.dumps(references))]
+
+    with tempfile.TemporaryDirectory() as directory:
+        bib = os.path.join(directory, "bibliography.bib")
+
+        with open(bib, "w") as file:
+            file.write("@article{a, title={A}}\n@article{b, title={B}}\n")
+
+        converted = get_csl_json(bib, directory, [command])
+
+        with open(converted, "r") as file:
+            assert json.load(file) == references, "failed on test 1.0"
+
+        # A second call is served from the cache without running the command
+        assert get_csl_json(bib, directory, []) == converted, "failed on test 1.1"
+
+        with open(prune(converted, {"b"}, directory), "r") as file:
+            assert json.load(file) == references[1:], "failed on test 1.2"
+
+        missing = os.path.join(directory, "missing.bib")
+
+        assert prepare_bibliography(missing, directory=directory) == missing, "failed on test 2.0"
+
+    return
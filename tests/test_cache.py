@@ -0,0 +1,89 @@
+""" Tests for cache.py """
+
+import os
+import tempfile
+
+from ltcstm.cache import PandocCache, get_cache
+
+
+def test_cache_round_trip():
+    """ Tests that PandocCache.put entries can be read back with PandocCache.get """
+
+    test_data = [
+        ["a" * 64, "Some *markdown*\n"],
+        ["b" * 64, ""],
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = PandocCache(directory)
+
+        for test, i in zip(test_data, range(len(test_data))):
+            assert cache.get(test[0]) is None, "failed on test 1.{}".format(i)
+            cache.put(test[0], test[1])
+            assert cache.get(test[0]) == test[1], "failed on test 2.{}".format(i)
+
+    return
+
+
+def test_cache_eviction():
+    """ Tests that the least recently used entries are removed first """
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = PandocCache(directory, max_size=20)
+
+        cache.put("old", "x" * 10)
+        cache.put("new", "y" * 10)
+        os.utime(cache.path("old"), (0, 0))
+        os.utime(cache.path("new"), (1, 1))
+
+        cache.get("old")  # now the most recently used
+        cache.put("newest", "z" * 10)
+
+        assert cache.get("new") is None, "failed on test 1.0"
+        assert cache.get("old") == "x" * 10, "failed on test 1.1"
+        assert cache.get("newest") == "z" * 10, "failed on test 1.2"
+
+    return
+
+
+def test_cache_size():
+    """ Tests that the total size is kept without scanning the directory on each put """
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = PandocCache(directory, max_size=100)
+        scans = []
+        entries = cache.entries
+        cache.entries = lambda: scans.append(1) or entries()
+
+        cache.put("a", "x" * 10)
+        cache.put("b", "y" * 20)
+        cache.put("a", "z" * 30)  # replaces the first entry
+
+        test_data = [cache.size, len(scans), PandocCache(directory).size]
+        expected_outcomes = [50, 0, 50]
+
+        for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+            assert test == expected, "failed on test 1.{}".format(i)
+
+        cache.put("c", "w" * 60)  # over max_size
+
+        assert len(scans) == 1, "failed on test 2.0"
+        assert cache.size == PandocCache(directory).size <= 100, "failed on test 2.1"
+
+    return
+
+
+def test_get_cache():
+    """ Tests the normalisation of the cache argument """
+
+    assert get_cache(False) is None, "failed on test 1.0"
+    assert get_cache(None) is None, "failed on test 1.1"
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = PandocCache(directory)
+        assert get_cache(cache) is cache, "failed on test 1.2"
+
+    # The default cache is only opened once
+    assert get_cache(True) is get_cache(True), "failed on test 2.0"
+
+    return
@@ -0,0 +1,218 @@
+""" Tests for convert.py """
+
+import asyncio
+import os
+import sys
+import tempfile
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+from ltcstm.convert import Converter, PandocServerPool, aconvert, aconvert_batch
+from ltcstm.convert import convert, get_converter, init_servers, share_servers
+from ltcstm.convert import get_sentinel, join_fragments, split_output
+
+
+def test_split_output():
+    """ Tests that joined fragments can be split again, including the <p> wrapping
+        that the HTML writer adds around the sentinels """
+
+    sentinel = get_sentinel(["a", "b"])
+
+    test_data = [
+        join_fragments(["This is a *call*", "", "two"], sentinel),
+        "<p>{0}0</p>\n<p>one</p>\n<p>{0}1</p>\n<p>two</p>\n".format(sentinel),
+        "{0}0\n\none\n".format(sentinel),
+    ]
+
+    expected_outcomes = [
+        ["This is a *call*\n", "", "two\n"],
+        ["<p>one</p>\n", "<p>two</p>\n"],
+        None,
+    ]
+
+    numbers = [3, 2, 2]
+
+    for test, expected, number, i in zip(test_data, expected_outcomes, numbers,
+                                         range(len(test_data))):
+        assert split_output(test, sentinel, number) == expected, "failed on test 1.{}".format(i)
+
+    return
+
+
+def test_get_sentinel():
+    """ Tests that the sentinel never appears in the fragments """
+
+    fragments = ["hello", "world"]
+    sentinel = get_sentinel(fragments)
+
+    assert get_sentinel(fragments + [sentinel]) != sentinel, "failed on test 1.0"
+
+    return
+
+
+FAKE_SERVER = """
+import json, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"fake")
+
+    def do_POST(self):
+        options = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        output = options["text"].upper()
+        if options.get("citeproc"):
+            output += " CITED"
+        body = json.dumps({"output": output, "base64": False})
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+HTTPServer(("127.0.0.1", int(sys.argv[sys.argv.index("--port") + 1])), Handler).serve_forever()
+"""
+
+
+class UpperConverter(Converter):
+    """ Stands in for the subprocess fallback """
+
+    def convert(self, text, to, format, extra_args=()):
+        return "fallback " + text
+
+
+FAKE_FILTER = """#!{}
+import sys
+sys.stdout.write(sys.stdin.read() + " filtered for " + sys.argv[1])
+"""
+
+
+def test_pandoc_server_pool():
+    """ Tests the pandoc server pool against a stand-in server and filter """
+
+    pool = PandocServerPool(2, command=[sys.executable, "-c", FAKE_SERVER],
+                            fallback=UpperConverter())
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            fake_filter = os.path.join(directory, "filter")
+
+            with open(fake_filter, "w") as file:
+                file.write(FAKE_FILTER.format(sys.executable))
+
+            os.chmod(fake_filter, 0o755)
+
+            test_data = [
+                ["hello", []],
+                ["world", ["--mathjax", "-F", "pandoc-citeproc"]],
+                ["hello", ["--standalone"]],
+                ["hello", ["-F", fake_filter, "-F", "pandoc-citeproc"]],
+            ]
+
+            expected_outcomes = [
+                "HELLO",
+                "WORLD CITED",
+                "fallback hello",
+                "HELLO FILTERED FOR HTML CITED",
+            ]
+
+            for test, expected, i in zip(test_data, expected_outcomes,
+                                         range(len(test_data))):
+                output = pool.convert(test[0], "html", "markdown", test[1])
+                assert output == expected, "failed on test 1.{}".format(i)
+
+        # A dead worker is restarted
+        pool.workers[0].process.kill()
+        pool.workers[0].process.wait()
+        pool.workers[1].process.kill()
+        pool.workers[1].process.wait()
+
+        assert pool.convert("again", "html", "markdown") == "AGAIN", "failed on test 2.0"
+    finally:
+        pool.close()
+
+    return
+
+
+def convert_in_job(text):
+    """ Converts text in a worker process, returning the output and the servers of
+        the process's pool """
+    output = convert(text, "html", "markdown")
+
+    return output, os.getpid(), [worker.url for worker in get_converter().workers]
+
+
+def test_pandoc_servers_jobs():
+    """ Tests that jobs (as with compile.py -j) share out the pandoc servers, and stop
+        them when they exit """
+
+    test_data = [[4, 2], [5, 2], [1, 4], [3, 0]]
+    expected_outcomes = [2, 2, 1, 3]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert share_servers(*test) == expected, "failed on test 1.{}".format(i)
+
+    texts = ["chapter {}".format(i) for i in range(8)]
+    command = [sys.executable, "-c", FAKE_SERVER]
+
+    with ProcessPoolExecutor(max_workers=2, initializer=init_servers,
+                             initargs=(share_servers(4, 2), command)) as pool:
+        results = list(pool.map(convert_in_job, texts))
+
+    servers = {}
+
+    for _, pid, urls in results:
+        servers.setdefault(pid, set()).update(url for url in urls if url)
+
+    assert [output for output, _, _ in results] == [x.upper() for x in texts], \
+        "failed on test 2.0"
+    assert len(servers) <= 2, "failed on test 2.1"
+    assert all(len(urls) <= 2 for urls in servers.values()), "failed on test 2.2"
+
+    for urls, i in zip(servers.values(), range(len(servers))):
+        for url in urls:
+            try:
+                urllib.request.urlopen(url + "/version", timeout=1.0).close()
+            except OSError:
+                continue
+
+            assert False, "failed on test 3.{}".format(i)
+
+    return
+
+
+class FakeSubprocessConverter(Converter):
+    """ Runs a stand-in for pandoc that upper-cases its input """
+
+    def command(self, to, format, extra_args=()):
+        return [sys.executable, "-c", "import sys; sys.stdout.write(sys.stdin.read().upper())"]
+
+
+def test_aconvert():
+    """ Tests the asyncio subprocess conversions, bounded by a semaphore """
+
+    converter = FakeSubprocessConverter()
+
+    async def run():
+        semaphore = asyncio.Semaphore(2)
+
+        single = await asyncio.gather(*[
+            aconvert(text, "markdown", "latex", converter=converter, semaphore=semaphore)
+            for text in ["one", "two", "three"]
+        ])
+
+        batch = await aconvert_batch(["four", "five"], "markdown", "latex",
+                                     converter=converter, semaphore=semaphore)
+
+        return single, batch
+
+    single, batch = asyncio.run(run())
+
+    assert single == ["ONE", "TWO", "THREE"], "failed on test 1.0"
+    # The sentinels are upper-cased too, so the batch falls back to single conversions
+    assert batch == ["FOUR", "FIVE"], "failed on test 1.1"
+
+    return
@@ -0,0 +1,39 @@
+""" Tests for html.py """
+
+import re
+
+from ltcstm.html import CommentIndex
+
+
+def test_comment_index():
+    """ Tests that CommentIndex.between agrees with the regex search it replaces """
+
+    html = "\n".join([
+        "<p>intro</p>",
+        "<!-- 10 -->",
+        "<p>first <!-- a comment --></p>",
+        "<!-- 11 -->",
+        "<p>second</p>",
+        "<!-- 12 -->",
+        "<!-- 10 -->",
+    ])
+
+    comments = CommentIndex(html)
+
+    test_data = [
+        ["10", "11"],
+        ["10", "12"],
+        ["11", "12"],
+        ["12", "10"],
+        ["12", "11"],
+        ["13", "10"],
+    ]
+
+    for test, i in zip(test_data, range(len(test_data))):
+        regex = r"<!-- {} -->(?P<txt>.*?)<!-- {} -->".format(test[0], test[1])
+        match = re.search(regex, html, re.MULTILINE + re.DOTALL)
+        expected = match.group("txt") if match else None
+
+        assert comments.between(test[0], test[1]) == expected, "failed on test 1.{}".format(i)
+
+    return
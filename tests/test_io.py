@@ -0,0 +1,103 @@
+""" Tests for io.py """
+
+import os
+import shutil
+import tempfile
+
+from ltcstm.blobs import BlobStore
+from ltcstm.convert import Converter
+from ltcstm.io import expand_filenames, process_many, write_many
+from ltcstm.io import process_file, read_ndjson, write_ndjson
+from ltcstm.storage import MasterData
+
+
+TEST_FILE = os.path.join(os.path.dirname(__file__), "integration_test", "test.tex")
+
+
+class IdentityConverter(Converter):
+    """ Stands in for pandoc """
+
+    def convert(self, text, to, format, extra_args=()):
+        return text
+
+
+def test_process_many():
+    """ Tests the batch processing of several files, with combined and separate outputs """
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ["a.tex", "b.tex"]:
+            shutil.copyfile(TEST_FILE, os.path.join(directory, name))
+
+        pattern = os.path.join(directory, "*.tex")
+        first = os.path.join(directory, "a.tex")
+
+        filenames = expand_filenames([first, pattern, "missing.tex"])
+
+        assert [os.path.basename(x) for x in filenames] == ["a.tex", "b.tex", "missing.tex"], \
+            "failed on test 1.0"
+
+        results = process_many([pattern], cache=False, converter=IdentityConverter())
+
+        assert list(results) == filenames[:2], "failed on test 1.1"
+        assert results[filenames[0]] == results[filenames[1]], "failed on test 1.2"
+
+        # The converter is handed to the worker processes too
+        parallel = process_many([pattern], cache=False, converter=IdentityConverter(),
+                                workers=2)
+
+        assert parallel == results, "failed on test 1.3"
+
+        test_data = [
+            write_many(results, os.path.join(directory, "out")),
+            write_many(results, os.path.join(directory, "out"), combined=True),
+        ]
+
+        expected_outcomes = [
+            ["a.sections.json", "a.lectures.json", "a.kps.json",
+             "b.sections.json", "b.lectures.json", "b.kps.json"],
+            ["sections.json", "lectures.json", "kps.json"],
+        ]
+
+        for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+            assert [os.path.basename(x) for x in test] == expected, "failed on test 2.{}".format(i)
+
+    return
+
+
+def test_ndjson():
+    """ Tests that the NDJSON output, with and without the blob store, holds the same
+        data as split_data """
+
+    secs, lecs, kps = process_file(TEST_FILE, cache=False, converter=IdentityConverter())
+
+    with open(TEST_FILE, "r") as file:
+        master_data = MasterData(file.read(), cache=False, converter=IdentityConverter())
+
+    with tempfile.TemporaryDirectory() as directory:
+        blobs = BlobStore(os.path.join(directory, "blobs"))
+        records = []
+
+        for name, store in [("inline.ndjson", None), ("blobs.ndjson", blobs)]:
+            filename = os.path.join(directory, name)
+
+            with open(filename, "w") as file:
+                write_ndjson(master_data, file, store)
+
+            records.append(list(read_ndjson(filename, blobs)))
+
+        assert records[0] == records[1], "failed on test 1.0"
+
+        test_data = [
+            [r["data"] for r in records[1] if r["type"] == "keypoint"],
+            {r["name"]: {"data": r["data"], "keypoints": r["keypoints"]}
+             for r in records[1] if r["type"] == "section"},
+            {r["name"]: {"data": r["data"], "keypoints": r["keypoints"]}
+             for r in records[1] if r["type"] == "lecture"},
+        ]
+
+        expected_outcomes = [kps, secs, lecs]
+
+        for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+            assert test == expected, "failed on test 2.{}".format(i)
+
+    return
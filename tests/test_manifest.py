@@ -0,0 +1,54 @@
+""" Tests for manifest.py """
+
+import os
+import tempfile
+
+from ltcstm.manifest import BuildManifest, same_contents, write_if_changed
+
+
+def test_write_if_changed():
+    """ Tests that identical files are not rewritten """
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "a.html")
+        destination = os.path.join(directory, "b.html")
+
+        expected_outcomes = [True, False, True]
+
+        for text, expected, i in zip(["one", "one", "two"], expected_outcomes, range(3)):
+            assert write_if_changed(source, text) == expected, "failed on test 1.{}".format(i)
+
+        # Hardlinked copies are not written through
+        os.link(source, destination)
+        write_if_changed(source, "three")
+
+        with open(destination, "r") as file:
+            assert file.read() == "two", "failed on test 1.3"
+
+        os.remove(destination)
+
+        write_if_changed(destination, "three")
+
+        assert same_contents(source, destination), "failed on test 2.0"
+
+    return
+
+
+def test_manifest_round_trip():
+    """ Tests that the manifest is saved and invalidated """
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = BuildManifest(directory)
+        manifest.invalidate("config", "bib")
+        manifest.chapters["a.tex"] = {"input": "hash"}
+        manifest.save()
+
+        manifest = BuildManifest(directory)
+
+        assert manifest.chapters == {"a.tex": {"input": "hash"}}, "failed on test 1.0"
+
+        manifest.invalidate("config", "new bib")
+
+        assert manifest.chapters == {}, "failed on test 2.0"
+
+    return
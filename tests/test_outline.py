@@ -0,0 +1,49 @@
+""" Tests for outline.py """
+
+from ltcstm.outline import get_outline
+
+
+def test_get_outline():
+    """ Tests the lecture/section tree, keypoint assignments and line ranges """
+
+    text = "\n".join([
+        r"%%\keypoint{Early}",
+        r"%%\lecture{1}",
+        r"%%\section{Intro}",
+        r"%%@pdfonly",
+        r"%%\keypoint{Hidden}",
+        r"%%@endpdfonly",
+        r"%%\keypoint{Shown}",
+        r"%%\lecture{2}",
+        r"%%\keypoint{Later}",
+    ])
+
+    outline = get_outline(text)
+
+    test_data = [
+        outline["lectures"],
+        outline["sections"],
+        outline["keypoints"],
+    ]
+
+    expected_outcomes = [
+        [
+            {"name": "1", "start": 1, "end": 7, "keypoints": [1], "sections": [0]},
+            {"name": "2", "start": 7, "end": 9, "keypoints": [2], "sections": []},
+        ],
+        [
+            {"name": "Intro", "start": 2, "end": 9, "keypoints": [1, 2], "lecture": 0},
+        ],
+        [
+            {"text": "Early", "line": 0, "lecture": None, "section": None},
+            {"text": "Shown", "line": 6, "lecture": 0, "section": 0},
+            {"text": "Later", "line": 8, "lecture": 1, "section": 0},
+        ],
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert test == expected, "failed on test 1.{}".format(i)
+
+    assert get_outline(iter(text.splitlines(keepends=True))) == outline, "failed on test 2.0"
+
+    return
@@ -2,16 +2,24 @@
 
 from ltcstm.regex import text_replace
 from ltcstm.regex import find_items
+from ltcstm.regex import multi_replace
+from ltcstm.regex import index_lines
+from ltcstm.regex import get_seed, seed_candidates, UIDGenerator, UID_REGEX
+from ltcstm.regex import scan_markers
 
 def test_text_replace():
-    """ Tests for the text_replace function - recursive """
+    """ Tests for the text_replace function, which replaces in order """
 
     test_data = [
         ["hello world dogs", ["hello", "world", "dogs"], ["x", "y", "z"]],
+        ["ab abc a", ["a", "abc"], ["1", "2"]],
+        ["a", ["a", "b"], ["b", "c"]],
     ]
 
     expected_outcomes = [
         "x y z",
+        "1b 1bc 1",
+        "c",
     ]
 
     for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
@@ -31,3 +39,100 @@ def test_find_items():
 
     for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
         assert find_items(test[0], test[1]) == expected, "failed on test 1.{}".format(i)
+
+
+def test_multi_replace():
+    """ Tests for the single-pass multi_replace function """
+
+    many = ["KEY-{}".format(i) for i in range(5000)]
+
+    test_data = [
+        ["hello world dogs", ["hello", "world", "dogs"], ["x", "y", "z"]],
+        ["ab abc a", ["a", "abc"], ["1", "2"]],
+        ["a a", ["a", "a"], ["x", "y"]],
+        ["nothing to do", [], []],
+        [" ".join(many), many, [str(i) for i in range(5000)]],
+    ]
+
+    expected_outcomes = [
+        "x y z",
+        "1b 2 1",
+        "x x",
+        "nothing to do",
+        " ".join(str(i) for i in range(5000)),
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert multi_replace(test[0], test[1], test[2]) == expected, "failed on test 1.{}".format(i)
+
+
+def test_index_lines():
+    """ Tests the single-pass line index """
+
+    uid = "KEY-0a1b2c3d-000012"
+
+    test_data = [
+        "hello\n{0} world\n\nand {0} again".format(uid),
+        "no markers\nhere",
+    ]
+
+    expected_outcomes = [
+        ({uid: 1}, 4),
+        ({}, 2),
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert index_lines(test) == expected, "failed on test 1.{}".format(i)
+
+
+def test_uid_generator():
+    """ Tests that the UIDs are deterministic, match UID_REGEX and avoid the text """
+
+    lines = ["some text", "with 7d2b in it"]
+    seed = get_seed(lines, 4)
+
+    test_data = [
+        seed == get_seed(list(lines), 4),
+        any(seed in line for line in lines),
+        get_seed(["no digits"], 6, digits=True).isdigit(),
+        list(seed_candidates("0123456789", 8)),
+    ]
+
+    expected_outcomes = [True, False, True, ["01234567", "12345678", "23456789"]]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert test == expected, "failed on test 1.{}".format(i)
+
+    generator = UIDGenerator("0a1b2c3d")
+    uids = [generator("LEC-"), generator("KEY-")]
+
+    assert uids == ["LEC-0a1b2c3d-000000", "KEY-0a1b2c3d-000001"], "failed on test 2.0"
+    assert all(UID_REGEX.fullmatch(uid) for uid in uids), "failed on test 2.1"
+
+    return
+
+
+def test_scan_markers():
+    """ Tests the combined lecture, section and keypoint scanner, including several
+        markers on one line """
+
+    test_data = [
+        "%%\\lecture{1}\ntext\n%%\\section{Intro}\n%%\\keypoint{$\\frac{a}{b}$}",
+        "%%\\keypt{not a marker} %%@pdfonly",
+        "%%\\keypoint{A} %%\\section{B}",
+        "%%\\keypoint{A} %%\\lecture{2} %%\\section{B}",
+        "%%\\section{A} %%\\keypoint{B}",
+    ]
+
+    expected_outcomes = [
+        [("lecture", "1", 0), ("section", "Intro", 19), ("keypoint", "$\\frac{a}{b}$", 37)],
+        [],
+        [("keypoint", "A", 0), ("section", "B", 15)],
+        [("keypoint", "A", 0), ("lecture", "2} %%\\section{B", 15)],
+        [("section", "A} %%\\keypoint{B", 0)],
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert scan_markers(test) == expected, "failed on test 1.{}".format(i)
+
+    return
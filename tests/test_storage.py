@@ -1,6 +1,19 @@
 """ Tests for storage.py """
 
-from ltcstm.storage import Keypoint, PreprocessedData, PostprocessedData
+import asyncio
+import hashlib
+import io
+import os
+import subprocess
+import tempfile
+
+import pypandoc
+
+from ltcstm.cache import PandocCache
+from ltcstm.convert import Converter
+from ltcstm.regex import fixed_seed
+from ltcstm.storage import Keypoint, Part, PartIndex, PreprocessedData, PostprocessedData
+from ltcstm.storage import MasterData
 
 def test_keypoint_extract_keypoint():
     """ Test for Keypoint.extract_keypoint() """
@@ -64,3 +77,295 @@ def test_find_start_stop():
         assert master.find_start_stop(test[0], test[1]) == expected, "failed on test 2.{}".format(j)
 
     return
+
+
+def test_part_index():
+    """ Tests the PartIndex.find bisection against the expected parts """
+
+    parts = [
+        Part("%%\\section{A}", 0, 3),
+        Part("%%\\section{B}", 3, 3),
+        Part("%%\\section{C}", 3, 10),
+    ]
+
+    test_data = [1, 3, 4, 9, 10, 0]
+
+    expected_outcomes = ["A", "C", "C", "C", "C", "C"]
+
+    index = PartIndex(parts)
+
+    for test, expected, j in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert index.find(test).name == expected, "failed on test 1.{}".format(j)
+
+    assert index.find_index(1) == 0, "failed on test 2.0"
+    assert index.find_index(0) == 2, "failed on test 2.1"
+
+    return
+
+
+def test_keypoint_slots():
+    """ Tests the slotted Keypoint and Part, and the keypoint's index references """
+
+    part = Part("%%\\section{A}", 0, 3, "SEC-0a1b2c3d-000000")
+    keypoint = Keypoint("%%\\keypoint{x}", "KEY-0a1b2c3d-000001", 1, section=part,
+                        section_index=0)
+
+    test_data = [
+        part.html,
+        keypoint.html,
+        hasattr(keypoint, "__dict__"),
+        keypoint.as_dict(),
+    ]
+
+    expected_outcomes = [
+        "<!-- SEC-0a1b2c3d-000000 -->",
+        "<!-- KEY-0a1b2c3d-000001 -->",
+        False,
+        {
+            "raw_data": "%%\\keypoint{x}",
+            "uid": "KEY-0a1b2c3d-000001",
+            "position": 1,
+            "lecture_index": None,
+            "section_index": 0,
+            "output_data": "x",
+        },
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert test == expected, "failed on test 1.{}".format(i)
+
+    return
+
+
+def test_preprocessed_streaming():
+    """ Tests that streaming lines through PreprocessedData matches the string version """
+
+    text = "\n".join([
+        r"%%\lecture{1}",
+        r"%%\section{Intro}",
+        r"Some text",
+        r"%%@pdfonly",
+        r"%%\keypoint{Hidden}",
+        r"%%@endpdfonly",
+        r"%%\keypoint{Shown}",
+    ])
+
+    streamed = PreprocessedData(iter(text.splitlines(keepends=True)), remove_pdfonly=True)
+
+    test_data = [
+        streamed.lectures,
+        streamed.sections,
+        streamed.keypoints,
+        streamed.output_text.splitlines()[2],
+        len(streamed.output_text.splitlines()),
+    ]
+
+    expected_outcomes = [
+        [r"%%\lecture{1}"],
+        [r"%%\section{Intro}"],
+        [r"%%\keypoint{Shown}"],
+        "Some text",
+        4,
+    ]
+
+    for test, expected, j in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert test == expected, "failed on test 1.{}".format(j)
+
+    return
+
+
+def test_preprocessed_deterministic():
+    """ Tests that the same input always gives the same UIDs, seeded from its hash,
+        and that a document that contains the placeholder seed is read again with
+        another """
+
+    text = "\n".join([r"%%\lecture{1}", r"%%\section{Intro}", r"%%\keypoint{A}"])
+    clash = text + "\nmentions " + fixed_seed(0)
+
+    first = PreprocessedData(text, remove_pdfonly=True)
+    second = PreprocessedData(iter(text.splitlines(keepends=True)), remove_pdfonly=True)
+    other = PreprocessedData(clash, remove_pdfonly=True)
+    seekable = PreprocessedData(io.StringIO(clash), remove_pdfonly=True)
+
+    test_data = [
+        first.output_text == second.output_text,
+        first.keypoint_uids == second.keypoint_uids,
+        hashlib.sha256(text.encode("utf-8")).hexdigest()[:8] in first.lecture_uids[0],
+        fixed_seed(0) in first.output_text,
+        other.output_text.count(fixed_seed(0)),
+        other.output_text.count(other.get_uid.seed),
+        other.output_text == seekable.output_text,
+        other.chars_in == seekable.chars_in == len(clash),
+    ]
+
+    expected_outcomes = [True, True, True, False, 1, 3, True, True]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert test == expected, "failed on test 1.{}".format(i)
+
+    try:
+        PreprocessedData(iter(clash.splitlines(keepends=True)))
+    except ValueError:
+        pass
+    else:
+        assert False, "failed on test 2.0"
+
+    return
+
+
+def test_preprocessed_unique():
+    """ Tests that different documents get different UIDs, so that they can be
+        combined """
+
+    test_data = [
+        "\n".join([r"%%\lecture{1}", r"%%\section{Intro}", r"%%\keypoint{A}"]),
+        "\n".join([r"%%\lecture{2}", r"%%\section{Intro}", r"%%\keypoint{A}"]),
+        "\n".join([r"%%\lecture{2}", r"%%\section{Intro}", r"%%\keypoint{B}"]),
+    ]
+
+    uids = []
+
+    for test in test_data:
+        pre = PreprocessedData(test)
+        uids.append(set(pre.lecture_uids + pre.section_uids + pre.keypoint_uids))
+
+    for i, first in enumerate(uids):
+        assert len(first) == 3, "failed on test 1.{}".format(i)
+
+        for j, second in enumerate(uids[i+1:], i + 1):
+            assert not first & second, "failed on test 2.{}.{}".format(i, j)
+
+    return
+
+
+class CountingConverter(Converter):
+    """ Stands in for pandoc, counting the conversions """
+
+    def __init__(self):
+        self.calls = 0
+
+
+    def convert(self, text, to, format, extra_args=()):
+        self.calls += 1
+        return text
+
+
+def test_master_data_lazy():
+    """ Tests that lazy MasterData only runs pandoc when it is needed, and then
+        agrees with the eager version """
+
+    text = "\n".join([
+        r"%%\lecture{1}",
+        r"%%\section{Intro}",
+        r"Some text",
+        r"%%\keypoint{A $\frac{1}{2}$}",
+        r"%%\section{Outro}",
+    ])
+
+    converter = CountingConverter()
+    lazy = MasterData(text, cache=False, converter=converter, lazy=True)
+
+    test_data = [
+        lazy.lecture_names,
+        lazy.section_names,
+        lazy.keypoint_texts,
+        converter.calls,
+    ]
+
+    expected_outcomes = [
+        ["1"],
+        ["Intro", "Outro"],
+        [r"A $\frac{1}{2}$"],
+        0,
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert test == expected, "failed on test 1.{}".format(i)
+
+    eager = MasterData(text, cache=False, converter=converter)
+
+    assert lazy.output_text == eager.output_text, "failed on test 2.0"
+    assert converter.calls == 2, "failed on test 2.1"
+    assert eager.section_names == lazy.section_names, "failed on test 2.2"
+    assert eager.keypoint_texts == lazy.keypoint_texts, "failed on test 2.3"
+
+    for i, name in enumerate(["preprocessed", "markdown", "postprocessed"]):
+        assert type(getattr(eager, name)) is type(getattr(lazy, name)), \
+            "failed on test 3.{}".format(i)
+
+    return
+
+
+def test_master_data_cache():
+    """ Tests that a rebuild of an unchanged document is served from the cache """
+
+    text = "\n".join([r"%%\lecture{1}", r"%%\section{Intro}", r"%%\keypoint{A}"])
+    converter = CountingConverter()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = PandocCache(directory)
+
+        first = MasterData(text, cache=cache, converter=converter)
+        calls = converter.calls
+        second = MasterData(text, cache=PandocCache(directory), converter=converter)
+
+        assert calls == 1, "failed on test 1.0"
+        assert converter.calls == calls, "failed on test 1.1"
+        assert first.output_text == second.output_text, "failed on test 1.2"
+
+        # The asynchronous version looks the cache up off the event loop
+        third = asyncio.run(MasterData.acreate(text, cache=PandocCache(directory),
+                                               converter=converter))
+
+        assert converter.calls == calls, "failed on test 2.0"
+        assert first.output_text == third.output_text, "failed on test 2.1"
+
+    return
+
+
+def test_master_data_cache_no_subprocess():
+    """ Tests that a rebuild from a warm cache, in a new process, never starts pandoc
+        or its filters, not even to ask for their versions """
+
+    text = "\n".join([r"%%\lecture{1}", r"%%\section{Intro}", r"%%\keypoint{A}"])
+    converter = CountingConverter()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("started a subprocess")
+
+    with tempfile.TemporaryDirectory() as directory:
+        tools = os.path.join(directory, "bin")
+        os.makedirs(tools)
+
+        for name in ["pandoc", "pandoc-crossref", "pandoc-citeproc"]:
+            with open(os.path.join(tools, name), "w") as file:
+                file.write("#!/bin/sh\necho {} 1.0\n".format(name))
+
+            os.chmod(os.path.join(tools, name), 0o755)
+
+        path = os.environ.get("PATH", "")
+        os.environ["PATH"] = tools + os.pathsep + path
+
+        try:
+            cache = PandocCache(os.path.join(directory, "cache"))
+            first = MasterData(text, cache=cache, converter=converter)
+
+            assert cache.tool_version(os.path.join(tools, "pandoc-crossref")) == \
+                "pandoc-crossref 1.0", "failed on test 1.0"
+
+            run, convert_text = subprocess.run, pypandoc.convert_text
+            subprocess.run = pypandoc.convert_text = fail
+
+            try:
+                # A new PandocCache has nothing in memory, as in a new process
+                second = MasterData(text, cache=PandocCache(cache.directory),
+                                    converter=converter)
+            finally:
+                subprocess.run, pypandoc.convert_text = run, convert_text
+        finally:
+            os.environ["PATH"] = path
+
+        assert converter.calls == 1, "failed on test 2.0"
+        assert first.output_text == second.output_text, "failed on test 2.1"
+
+    return
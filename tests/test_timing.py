@@ -0,0 +1,56 @@
+""" Tests for timing.py """
+
+from ltcstm.timing import TimingCollector, NullCollector
+
+
+def test_timing_collector():
+    """ Tests that stages, subprocess time and sizes are recorded """
+
+    seen = []
+    collector = TimingCollector(callback=seen.append)
+
+    with collector.stage("first", 10) as record:
+        with collector.subprocess():
+            pass
+
+        record["chars_out"] = 5
+
+    with collector.stage("second") as record:
+        record["chars_in"] = 5
+
+    report = collector.report()
+
+    test_data = [
+        [r["stage"] for r in report["stages"]],
+        [r["chars_in"] for r in report["stages"]],
+        report["stages"][0]["chars_out"],
+        len(seen),
+        report["stages"][0]["subprocess"] <= report["stages"][0]["wall"],
+    ]
+
+    expected_outcomes = [
+        ["first", "second"],
+        [10, 5],
+        5,
+        2,
+        True,
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert test == expected, "failed on test 1.{}".format(i)
+
+    return
+
+
+def test_null_collector():
+    """ Tests that the NullCollector records nothing """
+
+    collector = NullCollector()
+
+    with collector.stage("first") as record:
+        with collector.subprocess():
+            record["markers"]["keypoints"] = 1
+
+    assert collector.report()["stages"] == [], "failed on test 1.0"
+
+    return
@@ -0,0 +1,74 @@
+""" Tests for tokenizer.py """
+
+import itertools
+
+from ltcstm.tokenizer import parse, tokenize
+
+
+def test_tokenize():
+    """ Tests the token stream, including the characters that PLY rejected """
+
+    test_data = [
+        "a %%\\keypoint{b}\n",
+        "%%@pdfonly x %%@endpdfonly",
+        "50\\% and %% comment",
+        "a %",
+    ]
+
+    expected_outcomes = [
+        [("TEXT", ("TEXT", "a "), 0), ("KEY", ("keypoint", "b", "0"), 2),
+         ("TEXT", ("TEXT", "\n"), 16)],
+        [("PDFONLYBEGIN", ("PDFONLYBEGIN", ""), 0), ("TEXT", ("TEXT", " x "), 10),
+         ("PDFONLYEND", ("PDFONLYEND", None), 13)],
+        [("TEXT", ("TEXT", "50\\% and %% comment"), 0)],
+        ValueError,
+    ]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        counter = itertools.count()
+
+        try:
+            tokens = list(tokenize(test, lambda: str(next(counter))))
+        except ValueError:
+            tokens = ValueError
+
+        assert tokens == expected, "failed on test 1.{}".format(i)
+
+    return
+
+
+def test_parse():
+    """ Tests nesting pdfonly blocks and registering the keys """
+
+    text = ("a %%\\section{x}\nb %%@pdfonly\nc%%@pdfonly %%\\keypoint{k} %%@endpdfonly"
+            " e %%@endpdfonly f")
+
+    counter = itertools.count()
+    registered = []
+
+    blocks = parse(text, lambda: str(next(counter)), lambda *key: registered.append(key))
+
+    assert blocks == [
+        ("TEXT", "a "),
+        ("section", "x", "0"),
+        ("TEXT", "\nb "),
+        ("PDFONLY", [
+            ("TEXT", "\nc"),
+            ("PDFONLY", [("TEXT", " "), ("keypoint", "k", "1"), ("TEXT", " ")]),
+            ("TEXT", " e "),
+        ]),
+        ("TEXT", " f"),
+    ], "failed on test 1.0"
+
+    assert registered == [("section", "x", "0"), ("keypoint", "k", "1")], \
+        "failed on test 1.1"
+
+    for test, i in zip(["a %%@pdfonly b", "a %%@endpdfonly b"], range(2)):
+        try:
+            parse(test, lambda: "")
+        except ValueError:
+            continue
+
+        assert False, "failed on test 2.{}".format(i)
+
+    return
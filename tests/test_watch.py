@@ -0,0 +1,59 @@
+""" Tests for watch.py """
+
+import os
+import tempfile
+
+from ltcstm.watch import Watcher, changes, snapshot
+
+
+def test_changes():
+    """ Tests finding created, removed and modified files between snapshots """
+
+    test_data = [
+        [{"a": (1, 1)}, {"a": (1, 1)}],
+        [{"a": (1, 1)}, {"a": (1, 2), "b": (1, 1)}],
+        [{"a": (1, 1), "b": (1, 1)}, {"b": (1, 1)}],
+    ]
+
+    expected_outcomes = [set(), {"a", "b"}, {"a"}]
+
+    for test, expected, i in zip(test_data, expected_outcomes, range(len(test_data))):
+        assert changes(*test) == expected, "failed on test 1.{}".format(i)
+
+    return
+
+
+def test_watcher():
+    """ Tests that a burst of saves is reported once, after it has finished """
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "tex"))
+        first = os.path.join(directory, "tex", "a.tex")
+        second = os.path.join(directory, "tex", "b.tex")
+
+        with open(first, "w") as file:
+            file.write("a")
+
+        assert list(snapshot([directory])) == [first], "failed on test 1.0"
+
+        # Each sleep moves the clock on and performs the next save of the burst
+        saves = [(first, "ab"), None, (second, "b"), None, None, None, None, None]
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+            save = saves.pop(0) if saves else None
+
+            if save is not None:
+                with open(save[0], "w") as file:
+                    file.write(save[1])
+
+            return
+
+        watcher = Watcher([directory], interval=0.1, debounce=0.25,
+                          sleep=sleep, clock=lambda: now[0])
+
+        assert watcher.wait() == {first, second}, "failed on test 2.0"
+        assert watcher.poll() == set(), "failed on test 2.1"
+
+    return